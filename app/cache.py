@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+'''
+Small TTL caches for results of external calls (Genius searches, scraped pages, ...).
+
+A TTLCache stores JSON-serializable values in a store. SqliteStore keeps them in a local file that
+survives warm Lambda reuse; MemoryStore is a bounded in-process LRU, used for short-lived data and
+as a drop-in replacement for the file store in tests:
+
+    search_cache.store = MemoryStore()
+
+A cached None is a negative result ("not found") and is kept for the cache's negative_ttl.
+'''
+
+DEFAULT_CACHE_PATH = "/tmp/gakuji_cache.sqlite"
+
+# returned by TTLCache.get when nothing (not even a negative result) is cached
+MISSING = object()
+
+
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFKC", text or "").casefold().split())
+
+
+def content_key(*parts):
+    # stable key for a tuple of strings, independent of width, case and spacing differences
+    joined = "\x1f".join(normalize_text(part) for part in parts)
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+
+class MemoryStore:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None:
+                self.items.move_to_end(key)
+            return item
+
+    def set(self, key, expires_at, value):
+        with self.lock:
+            self.items[key] = (expires_at, value)
+            self.items.move_to_end(key)
+            if len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class SqliteStore:
+    def __init__(self, path=None):
+        self.path = path or os.getenv("CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=1, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL)")
+        self.conn.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT expires_at, value FROM cache WHERE key = ?", (key,)).fetchone()
+        return tuple(row) if row else None
+
+    def set(self, key, expires_at, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO cache (key, expires_at, value) VALUES (?, ?, ?)", (key, expires_at, value))
+
+    def delete(self, key):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM cache")
+
+
+_default_store = None
+
+
+def default_store():
+    # one shared file store per process; CACHE_BACKEND=memory keeps everything in memory instead
+    global _default_store
+    if _default_store is None:
+        if os.getenv("CACHE_BACKEND") == "memory":
+            _default_store = MemoryStore(maxsize=4096)
+        else:
+            try:
+                _default_store = SqliteStore()
+            except sqlite3.Error as e:
+                print(f"Cache file unavailable, using memory: {e}")
+                _default_store = MemoryStore(maxsize=4096)
+    return _default_store
+
+
+class TTLCache:
+    def __init__(self, namespace, ttl, negative_ttl=None, store=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.store = store if store is not None else default_store()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def get(self, key):
+        try:
+            item = self.store.get(self._key(key))
+        except sqlite3.Error:
+            item = None
+        if item is None or item[0] < time.time():
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return json.loads(item[1])
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        try:
+            self.store.set(self._key(key), time.time() + ttl, json.dumps(value, ensure_ascii=False))
+        except sqlite3.Error as e:
+            # a failed write only costs a future miss
+            print(f"Cache write failed for {self.namespace}: {e}")
+
+    def delete(self, key):
+        self.store.delete(self._key(key))
@@ -0,0 +1,53 @@
+import os
+from app.cache import MemoryStore
+from lexicon.word_entries import rehydrate, referenced_ids
+
+'''
+Read side of the shared WordEntry store (see lexicon/word_entries.py).
+
+Songs processed since migration 0009 keep word_refs instead of a full word_mapping. song_word_mapping()
+rebuilds the word_mapping the routes return, fetching only the entries this process hasn't seen yet. An
+entry id always names the same content, so cached entries never go stale and are only evicted for space.
+'''
+
+entry_cache = MemoryStore(maxsize=int(os.getenv("WORD_ENTRY_CACHE_SIZE", "20000")))
+NEVER = float("inf")
+# ids per WordEntry select; they go in the URL
+FETCH_CHUNK = 200
+
+
+def get_entries(supabase, ids):
+    """
+    Args:
+        supabase: Client
+        ids: WordEntry ids
+
+    Returns:
+        {id: entry} for every id that exists
+    """
+    entries = {}
+    missing = []
+    for id in ids:
+        item = entry_cache.get(id)
+        if item is None:
+            missing.append(id)
+        else:
+            entries[id] = item[1]
+    for i in range(0, len(missing), FETCH_CHUNK):
+        response = supabase.table("WordEntry").select("id, entry").in_("id", missing[i:i + FETCH_CHUNK]).execute()
+        for row in response.data:
+            entry_cache.set(row["id"], NEVER, row["entry"])
+            entries[row["id"]] = row["entry"]
+    return entries
+
+
+def song_word_mapping(supabase, song):
+    # a SongData row's word_mapping, rebuilt from word_refs when the row is stored that way (blocking; run through offload)
+    word_refs = song.get("word_refs")
+    if word_refs is None:
+        return song.get("word_mapping")
+    ids = referenced_ids(word_refs)
+    entries = get_entries(supabase, ids)
+    if len(entries) < len(ids):
+        raise LookupError(f"{len(ids) - len(entries)} word entries are missing from WordEntry")
+    return rehydrate(word_refs, entries)
@@ -4,6 +4,8 @@ from app.routers import auth, song, lists
 from mangum import Mangum
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
+from app.offload import offload
+from app.timing import ServerTimingMiddleware
 import os
 
 # uvicorn app.main:app --reload
@@ -25,7 +27,7 @@ async def root():
 
 @app.get("/users", summary="a sample summary for our get users endpoint")
 async def get_current_caregiver():
-    res = supabase.from_("users").select("*").execute()
+    res = await offload("supabase", supabase.from_("users").select("*").execute)
 
     return res.data
 
@@ -36,11 +38,29 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # read by browser clients for get-song caching and global song paging
+    expose_headers=["ETag", "X-Next-Cursor", "Server-Timing"],
 )
+# added last so it wraps everything, including CORS
+app.add_middleware(ServerTimingMiddleware)
 
 
 app.include_router(auth.router)
 app.include_router(song.router)
 app.include_router(lists.router)
 
-handler = Mangum(app)
+asgi_handler = Mangum(app)
+
+
+# EventBridge schedule on the API function (e.g. rate(5 minutes)): re-sends outbox rows that no request is going to retry,
+# such as ones left by an instance that was shut down after a failed send
+def flush_outbox():
+    sent = song.get_producer().flush(retry_outbox=True)
+    print(f"Outbox flush sent {sent} queue messages")
+    return {"sent": sent}
+
+
+def handler(event, context):
+    if event.get("source") == "aws.events":
+        return flush_outbox()
+    return asgi_handler(event, context)
@@ -33,12 +33,24 @@ class ManualAdd(BaseModel):
     refresh_token: str | None = None
     access_token: str | None = None
     
+class WordEntries(BaseModel):
+    title: str
+    artist: str
+    words: list[str]
+
+class EntryIds(BaseModel):
+    ids: list[str]
+
 class WordAdd(BaseModel):
     word: str
     title: str
     artist: str
     list_id: str | None = None
     
+class WordsCheck(BaseModel):
+    words: list[str]
+    type: str
+
 class ListAdd(BaseModel):
     list_name: str
     type: str
\ No newline at end of file
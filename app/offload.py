@@ -0,0 +1,55 @@
+import os
+from functools import partial
+import anyio
+from anyio import to_thread
+from app.timing import timer
+
+'''
+Runs blocking client calls (Supabase, spotipy, Genius, Selenium, boto3) off the event loop.
+
+Route handlers are async, so calling these clients directly stalls every other request in the
+process until the call returns. offload() runs the call in a worker thread instead, and each
+backend has its own concurrency limit so a burst of slow scrapes can't take every thread from
+the database calls:
+
+    response = await offload("supabase", supabase.table("List").select("*").execute)
+'''
+
+# maximum concurrent calls per backend, overridable with e.g. SUPABASE_CONCURRENCY=32
+DEFAULT_LIMITS = {
+    "supabase": 16,
+    "spotify": 8,
+    "genius": 8,
+    # each Selenium call holds a Chrome session, so this matches the driver pool size
+    "selenium": int(os.getenv("CHROME_POOL_SIZE", "2")),
+    "sqs": 8,
+}
+
+_limiters = {}
+
+
+def get_limiter(backend):
+    # limiters are created on first use so that they belong to the running event loop
+    limiter = _limiters.get(backend)
+    if limiter is None:
+        limit = int(os.getenv(f"{backend.upper()}_CONCURRENCY", DEFAULT_LIMITS[backend]))
+        limiter = anyio.CapacityLimiter(limit)
+        _limiters[backend] = limiter
+    return limiter
+
+
+async def offload(backend, fn, *args, **kwargs):
+    """
+    Call a blocking function in a worker thread, limited by the backend's concurrency limit.
+
+    Args:
+        backend: One of the DEFAULT_LIMITS keys
+        fn: Blocking callable
+        *args, **kwargs: Passed to fn
+
+    Returns:
+        Whatever fn returns. Exceptions raised by fn are raised here.
+    """
+    # timed per backend (including time spent waiting for the limiter) for the Server-Timing header
+    with timer(backend):
+        return await to_thread.run_sync(partial(fn, *args, **kwargs), limiter=get_limiter(backend))
@@ -1,10 +1,13 @@
 from fastapi import Body, Depends, status, HTTPException, APIRouter
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from db.supabase import create_supabase_client
+from db.supabase import create_supabase_client, create_user_client
 from app.dbmodels import User
 from app.models import Token, CreateUser
+from app.cache import TTLCache, MemoryStore, MISSING
+from app.offload import offload
 from dotenv import load_dotenv
 import os
+import jwt
 from typing import Union
 
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -16,8 +19,64 @@ oauth2_scheme = (
     if stage == "local"
     else OAuth2PasswordBearer(tokenUrl="/dev/auth/token")
 )
+# shared by every request, so it must never sign in or set a session (see db/supabase.py); only token checks use it
 supabase = create_supabase_client()
 
+# Supabase signs access tokens with the project JWT secret (HS256) or, with asymmetric signing keys, a key from its JWKS
+jwt_secret = os.getenv("SUPABASE_JWT_SECRET")
+jwks_url = f"{os.getenv('SUPABASE_URL')}/auth/v1/.well-known/jwks.json"
+jwks_client = None
+
+# User rows by id. Short TTL since other instances can't see invalidations; /auth/create-user invalidates locally.
+user_cache = TTLCache("user", ttl=60, negative_ttl=10, store=MemoryStore(maxsize=1024))
+
+def get_jwks_client():
+    global jwks_client
+    if jwks_client is None:
+        # signing keys are cached by the client and refetched at most hourly
+        jwks_client = jwt.PyJWKClient(jwks_url, cache_keys=True, lifespan=3600)
+    return jwks_client
+
+#verifies an access token locally (signature, expiry and audience) and returns the user id
+def verify_token(token: str) -> str:
+    algorithm = jwt.get_unverified_header(token).get("alg")
+    if algorithm == "HS256":
+        if not jwt_secret:
+            # no secret configured, so ask Supabase instead
+            return supabase.auth.get_user(token).user.id
+        key = jwt_secret
+    elif algorithm in ("RS256", "ES256"):
+        key = get_jwks_client().get_signing_key_from_jwt(token).key
+    else:
+        raise jwt.InvalidTokenError(f"Unsupported token algorithm: {algorithm}")
+    claims = jwt.decode(
+        token,
+        key,
+        algorithms=[algorithm],
+        audience="authenticated",
+        options={"require": ["exp", "sub"]},
+    )
+    return claims["sub"]
+
+def get_user_row(user_id: str, token: str):
+    row = user_cache.get(user_id)
+    if row is MISSING:
+        # read as the user themselves
+        user = (
+            create_user_client(token).from_("User").select("*").eq("id", user_id).execute()
+        )
+        row = user.data[0] if user.data else None
+        user_cache.set(user_id, row)
+    return row
+
+# these change the session of the client they run on, so each call gets its own (see db/supabase.py)
+def start_session(token: str, refresh_token: str):
+    return create_user_client().auth.set_session(token, refresh_token)
+
+def sign_in(credentials: dict):
+    # the tokens go back to the caller rather than staying on a client
+    return create_user_client().auth.sign_in_with_password(credentials)
+
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     credential_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -28,16 +87,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
 
     try:
 
-        data = supabase.auth.get_user(token)
-        user_id = data.user.id
+        # both only reach the network on a JWKS refresh or user cache miss
+        user_id = await offload("supabase", verify_token, token)
 
-        # First, try to find the user in the Caregiver table
-        user = (
-            supabase.from_("User").select("*").eq("id", user_id).execute()
-        )
-        if user.data:
-            # Assuming you have a Caregiver model that accepts the row data
-            return User(**user.data[0])
+        # First, try to find the user in the User table
+        row = await offload("supabase", get_user_row, user_id, token)
+        if row:
+            return User(**row)
 
     except Exception as e:
         print(e)  # Handle exceptions appropriately
@@ -45,7 +101,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     
 async def get_current_session(refresh_token: str, token: str = Depends(oauth2_scheme)):
     try:
-        session = supabase.auth.set_session(token, refresh_token)
+        session = await offload("supabase", start_session, token, refresh_token)
         if not session:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -67,23 +123,26 @@ async def read_users_me(current_user: User = Depends(get_current_user)):
 @router.post("/create-user")
 async def create_new_user(input: CreateUser, password: str = Body(...)):
     try:
+    # this request signs in, so it gets its own client and the upsert below runs as the new user
+        client = await offload("supabase", create_user_client)
     # check if user exists
-        db_user = (
-            supabase.from_("User").select("*").eq("email", input.email).execute()
+        db_user = await offload(
+            "supabase", client.from_("User").select("*").eq("email", input.email).execute
         )
         if len(db_user.data) == 0:
-            createdUser = supabase.auth.sign_up(
-                {"email": input.email, "password": password}
+            createdUser = await offload(
+                "supabase", client.auth.sign_up, {"email": input.email, "password": password}
             )
         else:
             # if the user exists, sign in, and use this and update it
-            createdUser = supabase.auth.sign_in_with_password(
-                {"email": input.email, "password": password}
+            createdUser = await offload(
+                "supabase", client.auth.sign_in_with_password, {"email": input.email, "password": password}
             )
         newUserDict = input.model_dump()
         newUserDict["id"] = createdUser.user.id
         # I usually use upsert instead of update because i don't have to worry if an entry exists or not
-        insert_user = supabase.from_("User").upsert({**newUserDict}).execute()
+        insert_user = await offload("supabase", client.from_("User").upsert({**newUserDict}).execute)
+        user_cache.delete(newUserDict["id"])
         return insert_user.data[0]
 # at this point there is an empty user in the db; we need to access the id of that empty user and add the details that we want
     except Exception as e:
@@ -95,8 +154,8 @@ async def create_new_user(input: CreateUser, password: str = Body(...)):
 
 @router.post("/token", response_model=Token)
 async def set_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    data = supabase.auth.sign_in_with_password(
-        {"email": form_data.username, "password": form_data.password}
+    data = await offload(
+        "supabase", sign_in, {"email": form_data.username, "password": form_data.password}
     )
     if not data:
         raise HTTPException(
@@ -104,8 +163,4 @@ async def set_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    supabase.auth.set_session(data.session.access_token, data.session.refresh_token)
     return {"access_token": data.session.access_token, "token_type": "bearer"}
-
-def return_session():
-    return supabase.auth.get_session()
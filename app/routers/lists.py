@@ -2,12 +2,13 @@ from fastapi import Body, Depends, status, HTTPException, APIRouter
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from db.supabase import create_supabase_client
 from app.dbmodels import User
-from app.models import WordAdd, ListAdd
+from app.models import WordAdd, ListAdd, WordsCheck
 from app.routers.song import get_kanji_data, create_word_return
 from dotenv import load_dotenv
 import os
 import json
 from app.routers.auth import get_current_user
+from app.offload import offload
 
 router = APIRouter(prefix="/lists", tags=["lists"])
 load_dotenv()
@@ -20,10 +21,13 @@ oauth2_scheme = (
 
 supabase = create_supabase_client()
 
+# upper bound for /check-all-lists-batch, keeps the request URL PostgREST receives within limits
+MAX_BATCH_WORDS = 500
+
 #get all lists for a particular user from the List table in supabase
 @router.get("/get-lists")
 async def get_lists(user: User = Depends(get_current_user)):
-    response = supabase.table("List").select("list_name, type, id").eq("user_id", user.id).execute()
+    response = await offload("supabase", supabase.table("List").select("list_name, type, id").eq("user_id", user.id).execute)
     return response
 
 #add a new list to the List table in supabase
@@ -34,50 +38,64 @@ async def add_list(listModel: ListAdd, user: User = Depends(get_current_user)):
     if list_name is None or type is None:
         return {"message": "Missing information. Please try again."}
     else:
-        response = supabase.table("List").insert({"list_name": list_name, "type": type, "user_id": user.id}).execute()
+        response = await offload("supabase", supabase.table("List").insert({"list_name": list_name, "type": type, "user_id": user.id}).execute)
         return response
     
 #delete a list from the List table in supabase
 @router.delete("/delete-list")
 async def delete_list(list_id: str, user: User = Depends(get_current_user)):
-    response = supabase.table("List").delete().eq("id", list_id).eq("user_id", user.id).execute()
+    response = await offload("supabase", supabase.table("List").delete().eq("id", list_id).eq("user_id", user.id).execute)
     return response
 
 # get a particular list given its id (list is stored in ListItem table)
 @router.get("/get-a-list")
 async def get_a_list(list_id: str, user: User = Depends(get_current_user)):
-    response = supabase.table("ListItem").select("title, artist, value").eq("list_id", list_id).execute()
+    response = await offload("supabase", supabase.table("ListItem").select("title, artist, value").eq("list_id", list_id).execute)
     return response
 
 # get all lists of a particular type (kanji or word) from List table
 @router.get("/get-type-lists")
 async def get_type_lists(type: str, user: User = Depends(get_current_user)):
-    response = supabase.table("List").select("list_name, type, id").eq("user_id", user.id).eq("type", type).execute()
+    response = await offload("supabase", supabase.table("List").select("list_name, type, id").eq("user_id", user.id).eq("type", type).execute)
     return response
 
-def list_has_word(list_id: str, word: str):
-    in_my_table = supabase.table("ListItem").select("*", count="exact").eq("list_id", list_id).eq("value", word).execute()
-    count = in_my_table.count
-    if count > 0:
-        return True
-    else:
-        return False
-    
+# lists of a given type with the ListItems matching any of `words` embedded, so one query answers which lists hold which words
+async def get_lists_with_items(user_id: str, type: str, words: list):
+    response = await offload(
+        "supabase",
+        supabase.table("List").select("list_name, id, ListItem(value)").eq("user_id", user_id).eq("type", type).in_("ListItem.value", words).execute,
+    )
+    return response.data
+
+def lists_without_words(lists, words):
+    saved = {list["id"]: {item["value"] for item in list["ListItem"]} for list in lists}
+    return {
+        word: [{"list_name": list["list_name"], "id": list["id"]} for list in lists if word not in saved[list["id"]]]
+        for word in words
+    }
+
 #check all lists of a particular type for a particular user for a particular word and return all lists that DO NOT contain the word
 @router.get("/check-all-lists")
 async def check_all_lists(word: str, type: str, user: User = Depends(get_current_user)):
-    response = supabase.table("List").select("list_name, id").eq("user_id", user.id).eq("type", type).execute()
-    lists_without_word = []
-    for list in response.data:
-        if not list_has_word(list["id"], word):
-            lists_without_word.append(list)
-    return lists_without_word
+    lists = await get_lists_with_items(user.id, type, [word])
+    return lists_without_words(lists, [word])[word]
+
+#same as check-all-lists for many words at once (e.g. every token in a song). Returns {word: [lists that DO NOT contain it]}
+@router.post("/check-all-lists-batch")
+async def check_all_lists_batch(wordsCheck: WordsCheck, user: User = Depends(get_current_user)):
+    words = list(dict.fromkeys(wordsCheck.words))
+    if not words:
+        return {}
+    if len(words) > MAX_BATCH_WORDS:
+        return {"message": f"Too many words. Send at most {MAX_BATCH_WORDS} at a time."}
+    lists = await get_lists_with_items(user.id, wordsCheck.type, words)
+    return lists_without_words(lists, words)
 
 
 #delete a word from a list
 @router.delete("/delete-word")
 async def delete_word(word: str, list_id: str, user: User = Depends(get_current_user)):
-    response = supabase.table("ListItem").delete().eq("list_id", list_id).eq("value", word).execute()
+    response = await offload("supabase", supabase.table("ListItem").delete().eq("list_id", list_id).eq("value", word).execute)
     return response
 
 #add word to a particular list. Words are added as idseqs, Kanji as themselves.
@@ -90,11 +108,11 @@ async def add_word(wordObject: WordAdd, user: User = Depends(get_current_user)):
     if word is None or artist is None or list_id is None or title is None:
         return {"message": "Missing information. Please try again."}
     else:
-        in_my_table = supabase.table("ListItem").select(count="exact").eq("title", title).eq("artist", artist).eq("list_id", list_id).eq("value", word).execute().count
+        in_my_table = (await offload("supabase", supabase.table("ListItem").select(count="exact").eq("title", title).eq("artist", artist).eq("list_id", list_id).eq("value", word).execute)).count
         if in_my_table > 0:
             return {"message": "Lyric already saved to this list."}
         else:
-            response = supabase.table("ListItem").insert({"title": title, "artist": artist, "list_id": list_id, "value": word}).execute()
+            response = await offload("supabase", supabase.table("ListItem").insert({"title": title, "artist": artist, "list_id": list_id, "value": word}).execute)
             return response
         
 #get the data for a particular word or kanji from a list, depending on the length of the value itself. You are given the value for the word or kanji, and the length of the string determines whether you use get_kanji_data (for a one-length string) or get_word (for a string of length > 1)
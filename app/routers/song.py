@@ -1,30 +1,33 @@
-from fastapi import Body, Depends, status, HTTPException, APIRouter
+from fastapi import Body, Depends, status, HTTPException, APIRouter, Request, Response
 from fastapi.security import OAuth2PasswordBearer
-from db.supabase import create_supabase_client
+from db.supabase import create_supabase_client, create_service_client
 from app.dbmodels import User
-from app.models import SpotifyAdd, ManualAdd, SearchAdd
+from app.models import SpotifyAdd, ManualAdd, SearchAdd, WordEntries, EntryIds
 from dotenv import load_dotenv
 import os
-from lyricsgenius import Genius
-from geniusdotpy.genius import Genius as GeniusSearch 
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-from jamdict import Jamdict
-import jamdict_data
+from lexicon.jmdict_index import get_index
+from lexicon.kanji_table import get_kanji_table
+from lexicon.romaji import kana_to_hepburn
 import re
-import fugashi
-import pykakasi
 import json
-from app.routers.auth import get_current_user, get_current_session
-import boto3
+import base64
+import gzip
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from app.routers.auth import get_current_user
 import random
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
+from app.scraping import fetch_lyrics, ScrapeError
+from app.cache import TTLCache, MemoryStore, MISSING, content_key
+from app.offload import offload
+from app.timing import timer
+from app.singleflight import SingleFlight
+from app.sqs_producer import create_producer
+from app.song_key import song_key
+from app.song_search import build_search_text, search_queries, get_kakasi
+from app.entry_store import get_entries, song_word_mapping
+from lexicon.word_entries import split_word_mapping
+from postgrest.exceptions import APIError
 
 router = APIRouter(prefix="/song", tags=["song"])
 load_dotenv()
@@ -58,41 +61,169 @@ proxy = {
     "http": random.choice(proxy_list_http)
 }
 
-client_credentials_manager = SpotifyClientCredentials(client_id=cid, client_secret=secret)
-sp = spotipy.Spotify(client_credentials_manager = client_credentials_manager)
-genius_search = GeniusSearch(client_access_token=genius_token)
-genius_search.excluded_terms = ["Romanized", "English", "Translation", "Türkçe", "Português"]
-
-#initialize tokenizing/japanese processing objects
-jam = Jamdict(memory_mode=True)
-tagger = fugashi.Tagger()
-kakasi = pykakasi.kakasi()
-kakasi.setMode("J", "H")
-kakasi.setMode("K", "H")
-conv = kakasi.getConverter()
+# Clients are created on first use (see the getters below) so a cold start only pays for what its request needs.
+# Their import and setup time shows up in Server-Timing as init-<name> on the request that creates them.
+sp = None
+genius_search = None
+producer = None
+service_supabase = None
+
+# Genius search hits by normalized (title, artist) and scraped lyrics by page URL. Misses are cached for less time.
+search_cache = TTLCache("genius-search", ttl=7 * 24 * 3600, negative_ttl=6 * 3600)
+lyrics_cache = TTLCache("genius-lyrics", ttl=30 * 24 * 3600, negative_ttl=3600)
+
+# stored get-song payloads by content encoding, in order of preference. Every processed song has payload_gzip;
+# payload_br is null when the worker that stored it had no brotli.
+PAYLOAD_ENCODINGS = (("br", "payload_br"), ("gzip", "payload_gzip"))
+
+# parsed songs for get-song-lines/get-word-entries. Held as objects (not JSON) since they are large, and never mutated.
+song_store = MemoryStore(maxsize=64)
+SONG_CACHE_SECONDS = 600
+MAX_SONG_LINES = 200
+MAX_WORD_ENTRIES = 500
+MAX_SEARCH_RESULTS = 50
+MAX_ENTRY_IDS = 500
+
+# concurrent adds of the same song share one scrape/insert/enqueue
+ingests = SingleFlight()
+# Postgres error code raised when the SongData claim for a song key already exists
+UNIQUE_VIOLATION = "23505"
+# a placeholder whose ingest hasn't finished after this long is assumed abandoned (the request crashed or timed out)
+CLAIM_TIMEOUT_SECONDS = int(os.getenv("CLAIM_TIMEOUT_SECONDS", "900"))
+# how long a request that lost the claim waits for the winner's ingest (API Gateway gives up after 29s), and how often it checks
+CLAIM_WAIT_SECONDS = float(os.getenv("CLAIM_WAIT_SECONDS", "20"))
+CLAIM_POLL_SECONDS = 1
 
 CONST_KANJI = r'[㐀-䶵一-鿋豈-頻]'
 HIRAGANA_FULL = r'[ぁ-ゟ]'
 KATAKANA_FULL = r'[゠-ヿ]'
 ALL_JAPANESE = f'{CONST_KANJI}|{HIRAGANA_FULL}|{KATAKANA_FULL}'
 
-#initialize AWS objects
-aws_session = boto3.Session(
-    aws_access_key_id=os.getenv("AWS_SERVER_PUBLIC_KEY"),
-    aws_secret_access_key=os.getenv("AWS_SERVER_SECRET_KEY"),
-    region_name="us-east-2"
-)
-
-#load kanji data
-def load_kanji_data(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        return json.load(file)
-kanji_data = load_kanji_data('kanji.json')
 supabase = create_supabase_client()
 
+def get_spotify():
+    global sp
+    if sp is None:
+        with timer("init-spotify"):
+            import spotipy
+            from spotipy.oauth2 import SpotifyClientCredentials
+            client_credentials_manager = SpotifyClientCredentials(client_id=cid, client_secret=secret)
+            sp = spotipy.Spotify(client_credentials_manager = client_credentials_manager)
+    return sp
+
+def get_genius_search():
+    global genius_search
+    if genius_search is None:
+        with timer("init-genius"):
+            from geniusdotpy.genius import Genius as GeniusSearch
+            genius_search = GeniusSearch(client_access_token=genius_token)
+            genius_search.excluded_terms = ["Romanized", "English", "Translation", "Türkçe", "Português"]
+    return genius_search
+
+# one producer per process; songs go to the long running function through it (and its outbox)
+def get_producer():
+    global producer
+    if producer is None:
+        with timer("init-sqs"):
+            import boto3
+            aws_session = boto3.Session(
+                aws_access_key_id=os.getenv("AWS_SERVER_PUBLIC_KEY"),
+                aws_secret_access_key=os.getenv("AWS_SERVER_SECRET_KEY"),
+                region_name="us-east-2"
+            )
+            # the outbox table is service role only, so it gets its own client rather than this router's
+            producer = create_producer(sqs_url, aws_session, create_service_client())
+    return producer
+
+# SongData is written through the service role: RLS hides its rows from this router's anon client, so claims, ingest
+# updates and releases made with that client would match nothing
+def get_service_supabase():
+    global service_supabase
+    if service_supabase is None:
+        service_supabase = create_service_client()
+        if service_supabase is None:
+            raise RuntimeError("SUPABASE_SERVICE_ROLE_KEY is not set, so songs can't be added")
+    return service_supabase
+
+# the content codings an Accept-Encoding header allows
+def accepted_encodings(accept_encoding):
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, *params = part.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+# picks the stored get-song payload to send: brotli, then gzip, then the gzip body decompressed here. Only columns the row
+# actually has are picked, so a song stored without brotli still goes out gzipped. Returns (content encoding, column).
+def choose_payload(accepted, stored):
+    for encoding, column in PAYLOAD_ENCODINGS:
+        if encoding in accepted and stored.get(column) is not None:
+            return encoding, column
+    return None, "payload_gzip"
+
+def etag_matches(if_none_match, etag):
+    # weak comparison, as If-None-Match requires
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag.removeprefix("W/") for tag in if_none_match.split(","))
+
+# fills in word_mapping for a SongData row read with word_refs (see app/entry_store.py); the row then has the shape the routes return
+async def with_word_mapping(song):
+    if song.get("word_refs") is not None:
+        song["word_mapping"] = await offload("supabase", song_word_mapping, supabase, song)
+    song.pop("word_refs", None)
+    return song
+
+# returns a song's lyrics, hiragana_lyrics, word_mapping and kanji_data (or None), through a small LRU so paging through a song reads it once
+async def load_song(title, artist):
+    key = song_key(title, artist)
+    item = song_store.get(key)
+    if item is not None and item[0] > time.time():
+        return item[1]
+    response = await offload("supabase", supabase.table("SongData").select("lyrics, hiragana_lyrics, word_mapping, word_refs, kanji_data").eq("song_key", key).execute)
+    if not response.data:
+        return None
+    song = await with_word_mapping(response.data[0])
+    # only processed songs are cached, the rest are still changing
+    if song["lyrics"] is not None:
+        song_store.set(key, time.time() + SONG_CACHE_SECONDS, song)
+    return song
+
+# opaque page cursors: the sort key values of the last row on a page
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("invalid cursor")
+    return values
+
+# PostgREST filter for rows strictly after `values` in descending (keys...) order: k1 < v1 or (k1 = v1 and k2 < v2) or ...
+def keyset_filter(keys, values):
+    def quote(value):
+        return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+    conditions = []
+    for i, key in enumerate(keys):
+        parts = [f"{keys[j]}.eq.{quote(values[j])}" for j in range(i)] + [f"{key}.lt.{quote(values[i])}"]
+        conditions.append(parts[0] if len(parts) == 1 else f"and({','.join(parts)})")
+    return ",".join(conditions)
+
 #gets the song from a given URI, returns artist and song of the track.
 async def get_song_from_spotify(uri):
-    track = sp.track(uri, market="JP")
+    track = await offload("spotify", get_spotify().track, uri, market="JP")
     artist = track['artists'][0]['name']
     song = track['name']
     image = track['album']['images'][0]['url']
@@ -102,81 +233,58 @@ def get_image_from_spotify(artist, title):
     # print("Artist: ", artist)
     # print("Title: ", title)
     query = f"track:{title} artist:{artist}"
-    track = sp.search(q=query, limit=1, offset=0, type="track", market="JP")
+    track = get_spotify().search(q=query, limit=1, offset=0, type="track", market="JP")
     return track['tracks']['items'][0]['album']['images'][0]['url']
 
-def scrape_lyrics_with_selenium(url, user_agent):
-    """Scrape lyrics from Genius using Selenium."""
-    
-    options = Options()
-    options.add_argument("--headless")  # Run in headless mode
-    options.add_argument(f"user-agent={user_agent}")
-    options.add_argument("--disable-blink-features=AutomationControlled")
-    options.add_argument("--disable-infobars")
-    options.add_argument("--disable-extensions")
-    
-    # 🚀 **Speed Boost: Block images & scripts**  
-    options.add_argument("--blink-settings=imagesEnabled=false")
-    options.add_experimental_option("prefs", {
-        "profile.managed_default_content_settings.images": 2,  # Disable images
-        "profile.managed_default_content_settings.stylesheets": 2,  # Disable CSS
-        "profile.managed_default_content_settings.javascript": 1,  # Keep JS enabled
-    })
-    
-    service = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=options)
-    
-    try:
-        driver.get(url) # Allow page to load
-
-        # Find all divs where data-lyrics-container="true"
-        lyrics_elements = WebDriverWait(driver, 5).until(
-            EC.presence_of_all_elements_located((By.XPATH, '//div[@data-lyrics-container="true"]'))
-        )
+#finds the Genius page for a song. Results, including "not found", are cached by normalized (title, artist).
+def find_genius_url(artist, title, user_agent):
+    key = content_key(title, artist)
+    url = search_cache.get(key)
+    if url is not MISSING:
+        return url
 
-        lyrics = "\n".join([elem.text for elem in lyrics_elements if elem.text.strip()])
-        return lyrics
-
-    except Exception as e:
-        print("Error scraping lyrics:", e)
-        return None
-
-    finally:
-        driver.quit()
-
-def get_lyrics(artist, title, user_agent):
-    genius = Genius(genius_token, user_agent=user_agent, proxy=proxy)
     # print("Artist: ", artist)
     # print("Title: ", title)
-    songs = genius_search.search(title)
+    songs = get_genius_search().search(title)
     # print("Songs with this artist and title: ", songs)
-    # pipe to a file
-    # with open("songs.json", "w") as f:
-    #     f.write(str(songs))
-    id = None
     url = None
-
     for track in songs:
         if artist in track.artist.name:
-            song_id = track.id
             url = track.url
             break
 
-    lyrics = None
-    if url is not None:
-        # other_source = genius.search_song(song_id=id)
-        # print("Primary source: ", other_source)
-        lyrics = scrape_lyrics_with_selenium(url, user_agent)
-        # lyrics = other_source.lyrics  
-    else:
+    if url is None:
         #desperate times...
+        from lyricsgenius import Genius
+        genius = Genius(genius_token, user_agent=user_agent, proxy=proxy)
         other_source = genius.search_song(title, artist)
-        lyrics = scrape_lyrics_with_selenium(other_source.url, user_agent)
-        # print("Other source: ", other_source)
-        # lyrics = other_source.lyrics
-        
+        if other_source is not None:
+            url = other_source.url
+
+    search_cache.set(key, url)
+    return url
+
+#returns the lyrics for a song and which path served them ("http", "selenium", "cache" or None). Pages are cached by URL;
+#a page without lyrics is cached for less time, and a page that couldn't be fetched isn't cached at all.
+async def get_lyrics(artist, title, user_agent):
+    with timer("lyrics-search"):
+        url = await offload("genius", find_genius_url, artist, title, user_agent)
+    if url is None:
+        return None, None
+
+    cached = lyrics_cache.get(url)
+    if cached is not MISSING:
+        return cached, "cache" if cached else None
+
+    with timer("scrape"):
+        try:
+            lyrics, source = await fetch_lyrics(url, user_agent)
+        except ScrapeError as e:
+            print(f"Could not fetch lyrics from {url}: {e}")
+            return None, None
+    lyrics_cache.set(url, lyrics)
     # print(lyrics)
-    return lyrics
+    return lyrics, source
 
 def delete_before_line_break(s, artist):
     # Extract Japanese characters from artist name
@@ -203,12 +311,13 @@ def delete_before_line_break(s, artist):
 
 #clean up common excess data brought in using the API.
 def clean_lyrics(lyrics, artist):
-    lyrics = delete_before_line_break(lyrics, artist)
-    # Remove "You might also like" text only
-    lyrics = re.sub(r'You might also like', '', lyrics)
-    # Remove "number followed by Embed"
-    lyrics = re.sub(r'\d+Embed', '', lyrics)
-    lyrics = re.sub(r'Embed', '', lyrics)
+    with timer("clean-lyrics"):
+        lyrics = delete_before_line_break(lyrics, artist)
+        # Remove "You might also like" text only
+        lyrics = re.sub(r'You might also like', '', lyrics)
+        # Remove "number followed by Embed"
+        lyrics = re.sub(r'\d+Embed', '', lyrics)
+        lyrics = re.sub(r'Embed', '', lyrics)
     if bool(re.search(ALL_JAPANESE, lyrics)):
         # print("Cleaned lyrics", lyrics)
         return lyrics
@@ -222,43 +331,31 @@ def extract_unicode_block(unicode_block, string):
 		Note that you must use the unicode blocks defined above, or patterns of similar form '''
 	return re.findall( unicode_block, string)
 
-#gets the desired data about a particular kanji contained in the lyrics.
+#gets the desired data about a particular kanji contained in the lyrics (kanji.json data plus KRADFILE radicals, from the prebuilt kanji table).
 def get_kanji_data(kanji):
-    if kanji in kanji_data:
-        data = kanji_data[kanji]
-        radicals = jam.krad[kanji]
-        sending_data = {
-            "jlpt_new": data["jlpt_new"],
-            "meanings": data["meanings"],
-            "readings_on": data["readings_on"],
-            "readings_kun": data["readings_kun"],
-            "radicals": radicals
-        }
-        return sending_data
-    else:
-        return None
+    return get_kanji_table().get(kanji)
     
-# gets the data for all kanji in the lyrics
+# gets the data for all kanji in the lyrics, looking each distinct kanji up once
 def get_all_kanji_data(kanji_list):
     all_kanji_data = {}
-    for kanji in kanji_list:
-        data = get_kanji_data(kanji)
-        all_kanji_data[kanji] = data
+    with timer("kanji"):
+        for kanji in dict.fromkeys(kanji_list):
+            all_kanji_data[kanji] = get_kanji_data(kanji)
     return all_kanji_data
 
 
 def create_word_return(idseq):
-    word_result = jam.lookup("id#"+idseq).to_dict()['entries'][0]
+    word_result = get_index().get(int(idseq))
     word = word_result['kanji'][0]['text']
     furigana = word_result['kana'][0]['text']
-    romaji = kakasi.convert(furigana)[0]["hepburn"]
+    romaji = kana_to_hepburn(furigana)
+    if romaji is None:
+        romaji = get_kakasi().convert(furigana)[0]["hepburn"]
     word_properties = []
     # all definitions availabile for this ID
     for sense in word_result['senses']:
         pos = sense['pos'] #part of speech(es), LIST
-        definition = [] #isolating the defintions, LIST
-        for sense_gloss in sense["SenseGloss"]:
-            definition.append(sense_gloss["text"])
+        definition = list(sense['gloss']) #isolating the defintions, LIST
         word_property = {
             "pos": pos,
             "definition": definition
@@ -275,147 +372,223 @@ def create_word_return(idseq):
     return result
     
 
+# the earliest claimed_at of a claim that is still live, as a PostgREST filter value
+def claim_cutoff():
+    return (datetime.now(timezone.utc) - timedelta(seconds=CLAIM_TIMEOUT_SECONDS)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+#claims a song for ingestion by inserting its placeholder SongData row. The unique song_key index makes this fail for everyone but the first request,
+#unless the existing placeholder was abandoned: its ingest never finished and its claim expired, in which case it is taken over.
+async def claim_song(title, artist):
+    service = get_service_supabase()
+    try:
+        await offload("supabase", service.table("SongData").insert({
+        "title": title, 
+        "artist": artist, 
+        "song_key": song_key(title, artist), 
+        "search_text": build_search_text(title, artist), 
+        "lyrics": None, 
+        "hiragana_lyrics": None, 
+        "word_mapping": None, 
+        "kanji_data": None, 
+        "image_url": None
+        }).execute)
+        return True
+    except APIError as e:
+        if e.code != UNIQUE_VIOLATION:
+            raise
+    # a single conditional update, so only one request can take over an expired claim
+    response = await offload("supabase", service.table("SongData").update({
+    "claimed_at": datetime.now(timezone.utc).isoformat()
+    }).eq("song_key", song_key(title, artist)).is_("kanji_data", "null").is_("lyrics", "null").or_(f"claimed_at.is.null,claimed_at.lt.{claim_cutoff()}").execute)
+    if response.data:
+        print(f"Took over an expired claim on {title} by {artist}")
+    return bool(response.data)
+
+#removes a placeholder SongData row whose ingest failed, so the song can be added again later
+async def release_song(title, artist):
+    try:
+        response = await offload("supabase", get_service_supabase().table("SongData").delete().eq("song_key", song_key(title, artist)).is_("lyrics", "null").execute)
+    except Exception as e:
+        print(f"Could not release claim on {title} by {artist}: {e}")
+        return
+    if not response.data:
+        print(f"Releasing the claim on {title} by {artist} deleted no SongData row")
+
+#fills in the placeholder SongData row and sends the song to the long running function
+async def finish_ingest(title, artist, cleaned_lyrics, all_kanji_data, image_url):
+    response = await offload("supabase", get_service_supabase().table("SongData").update({
+    "kanji_data": all_kanji_data, 
+    "image_url": image_url
+    }).eq("song_key", song_key(title, artist)).execute)
+    if not response.data:
+        # the placeholder is gone, so there is nothing for the worker to fill in
+        raise RuntimeError(f"No SongData row to finish for {title} by {artist}")
+
+    # send to SQS
+    body = {
+        "song": title,
+        "artist": artist,
+        "song_key": song_key(title, artist),
+        "cleaned_lyrics": cleaned_lyrics
+    }
+    await offload("sqs", get_producer().send, body)
+
+# the title and artist SongData stores for a song key, or None. Song rows use these so they always match their SongData row.
+# An abandoned placeholder (see claim_song) counts as missing, so the song gets ingested again.
+async def find_song_data(key):
+    response = await offload("supabase", supabase.table("SongData").select("title, artist").eq("song_key", key).or_(f"kanji_data.not.is.null,claimed_at.gte.{claim_cutoff()}").limit(1).execute)
+    return response.data[0] if response.data else None
+
+#waits for another instance's ingest of a song. Returns None once it has finished (kanji_data is filled in), or an error response
+#if it was released (the ingest failed) or is still running after CLAIM_WAIT_SECONDS.
+async def wait_for_claim(key):
+    deadline = time.monotonic() + CLAIM_WAIT_SECONDS
+    while True:
+        # kanji_data is small (null) until the ingest finishes, and then only read once
+        response = await offload("supabase", supabase.table("SongData").select("claimed_at, kanji_data").eq("song_key", key).execute)
+        song = response.data[0] if response.data else None
+        if song is not None and song["kanji_data"] is not None:
+            return None
+        expired = datetime.now(timezone.utc) - timedelta(seconds=CLAIM_TIMEOUT_SECONDS)
+        if song is None or song["claimed_at"] is None or datetime.fromisoformat(song["claimed_at"]) < expired:
+            return {"message": "Adding this song failed. Please try again."}
+        if time.monotonic() >= deadline:
+            return {"message": "This song is still being added. Try again in a moment.", "status": "pending"}
+        await asyncio.sleep(CLAIM_POLL_SECONDS)
+
+async def ingest_once(title, artist, ingest):
+    """
+    Runs `ingest` for a song at most once at a time. Concurrent requests in this process for the same song wait for
+    the first one's result, and requests in other instances lose the database claim and wait for the winner's row
+    to be filled in (or released) instead.
+
+    Args:
+        title: Song title
+        artist: Song artist
+        ingest: Coroutine function that scrapes/processes the song and calls finish_ingest. Returns (message, lyrics_source),
+            where message is an error response or None on success.
+
+    Returns:
+        (message, lyrics_source) from the request that did the work
+    """
+    async def claimed_ingest():
+        try:
+            if not await claim_song(title, artist):
+                # another instance is already adding this song; its result is this request's result
+                return await wait_for_claim(song_key(title, artist)), None
+        except Exception as e:
+            return {"message": f"An error occurred while inserting the song data: {str(e)}"}, None
+        try:
+            message, lyrics_source = await ingest()
+        except Exception:
+            await release_song(title, artist)
+            raise
+        if message is not None:
+            await release_song(title, artist)
+        return message, lyrics_source
+
+    return await ingests.do(song_key(title, artist), claimed_ingest)
+
+
 #need a route which takes in a spotify uri and adds the processed song to the database.
 @router.post("/add-song-spot")
 async def add_song_spot(spotifyItem: SpotifyAdd = None, user: User = Depends(get_current_user)):
     uri = spotifyItem.uri
-    refresh_token = spotifyItem.refresh_token
-    access_token = spotifyItem.access_token
     user_agent = spotifyItem.user_agent
     if spotifyItem is None or user is None:
         return {"message": "Missing information. Please try again."}
     artist, song, image = await get_song_from_spotify(uri)
     # Check if the song already exists in the user's personal song table
-    temp_artist = '%'+artist+'%'
-    temp_song = '%'+song+'%'
-    in_my_table = supabase.table("Song").select(count="exact").eq("title", song).eq("artist", artist).eq("id", user.id).execute().count
+    key = song_key(song, artist)
+    in_my_table = (await offload("supabase", supabase.table("Song").select(count="exact").eq("song_key", key).eq("id", user.id).execute)).count
     if in_my_table:
         return {"message": "Song already in database for this user."}
 
     # Check if the song exists in the global SongData table
-    # in_table = supabase.table("SongData").select(count="exact").eq("title", song).eq("artist", artist).execute().count
-    
-    in_table = supabase.table("SongData").select(count="exact").ilike("title", temp_song).ilike("artist", temp_artist).execute()
+    lyrics_source = None
+    in_table = await find_song_data(key)
     # print("Artist", artist)
     # print("Song", song)
     # print("In table", in_table)
-    if not in_table.count:
-        # Retrieve song data if it exists
-        lyrics = get_lyrics(artist, song, user_agent)
-        
-        if lyrics is None:
-            return {"message": "No lyrics found for this song."}
-
-        # Preparing for SQS send and getting Kanji
-        cleaned_lyrics = clean_lyrics(lyrics, artist)
-        if cleaned_lyrics is None:
-            return {"message": "No Japanese lyrics found for this song. Try searching for the song manually."}
-        kanji_list = extract_unicode_block(CONST_KANJI, cleaned_lyrics)
-        if not kanji_list:
-            return {"message": "Error! Seems like we can't get the lyrics from the link. Try searching for the song manually."}
-        all_kanji_data = get_all_kanji_data(kanji_list)
-
-        # Insert the song data into the global database only if it doesn't already exist
-        try:
-            response = supabase.table("SongData").insert({
-            "title": song, 
-            "artist": artist, 
-            "lyrics": None, 
-            "hiragana_lyrics": None, 
-            "word_mapping": None, 
-            "kanji_data": all_kanji_data, 
-            "image_url": image
-            }).execute()
-        except Exception as e:
-            return {"message": f"An error occurred while inserting the song data: {str(e)}"}
-        
-        # send to SQS
-        body = {
-            "song": song,
-            "artist": artist,
-            "cleaned_lyrics": cleaned_lyrics,
-            "access_token": access_token,
-            "refresh_token": refresh_token
-        }
-        sqs = aws_session.resource('sqs')
-        queue = sqs.Queue(sqs_url)
-        queue.send_message(
-            MessageBody=json.dumps(body)
-        )
+    if in_table is None:
+        async def ingest():
+            # Retrieve song data if it exists
+            lyrics, lyrics_source = await get_lyrics(artist, song, user_agent)
+            
+            if lyrics is None:
+                return {"message": "No lyrics found for this song."}, lyrics_source
+
+            # Preparing for SQS send and getting Kanji
+            cleaned_lyrics = clean_lyrics(lyrics, artist)
+            if cleaned_lyrics is None:
+                return {"message": "No Japanese lyrics found for this song. Try searching for the song manually."}, lyrics_source
+            kanji_list = extract_unicode_block(CONST_KANJI, cleaned_lyrics)
+            if not kanji_list:
+                return {"message": "Error! Seems like we can't get the lyrics from the link. Try searching for the song manually."}, lyrics_source
+            all_kanji_data = get_all_kanji_data(kanji_list)
+
+            await finish_ingest(song, artist, cleaned_lyrics, all_kanji_data, image)
+            return None, lyrics_source
+
+        message, lyrics_source = await ingest_once(song, artist, ingest)
+        if message is not None:
+            return message
+        in_table = await find_song_data(key) or {"title": song, "artist": artist}
 
     # Song has been successfully added to the global database, now add for the specific user
-    response = supabase.table("Song").insert({"title": song, "artist": artist, "id": user.id}).execute()
+    response = await offload("supabase", supabase.table("Song").insert({"title": in_table["title"], "artist": in_table["artist"], "song_key": key, "id": user.id}).execute)
     # print(response)
-    return {"message": "Song added successfully.", "status": "success"}
+    return {"message": "Song added successfully.", "status": "success", "lyrics_source": lyrics_source}
 
 
 #need a route which takes in artist and title, searches, and adds the processed song to the database.
 @router.post("/add-song-search")
 async def add_song_search(searchItem: SearchAdd = None, user: User = Depends(get_current_user)):
-    refresh_token = searchItem.refresh_token
-    access_token = searchItem.access_token
     artist = searchItem.artist
     title = searchItem.title
     user_agent = searchItem.user_agent
     if searchItem is None or user is None:
         return {"message": "Missing information. Please try again."}
     # Check if the song already exists in the user's personal song table
-    in_my_table = supabase.table("Song").select(count="exact").eq("title", title).eq("artist", artist).eq("id", user.id).execute().count
+    key = song_key(title, artist)
+    in_my_table = (await offload("supabase", supabase.table("Song").select(count="exact").eq("song_key", key).eq("id", user.id).execute)).count
     if in_my_table:
         return {"message": "Song already in database for this user."}
 
     # Check if the song exists in the global SongData table
-    in_table = supabase.table("SongData").select(count="exact").eq("title", title).eq("artist", artist).execute().count
-    if not in_table:
-        # Retrieve song data if it exists
-        lyrics = get_lyrics(artist, title, user_agent)
-        
-        if lyrics is None:
-            return {"message": "No lyrics found for this song."}
-        
-        image_url = get_image_from_spotify(artist, title)
-
-        # Preparing for SQS send and getting Kanji
-        cleaned_lyrics = clean_lyrics(lyrics, artist)
-        if cleaned_lyrics is None:
-            return {"message": "No Japanese lyrics found for this song. Paste the lyrics in."}
-        kanji_list = extract_unicode_block(CONST_KANJI, cleaned_lyrics)
-        if not kanji_list:
-            return {"message": "Error! Seems like we can't get the lyrics from the search. Paste the lyrics in."}
-        all_kanji_data = get_all_kanji_data(kanji_list)
-
-        # Insert the song data into the global database only if it doesn't already exist        
-        try:
-            response = supabase.table("SongData").insert({
-            "title": title, 
-            "artist": artist, 
-            "lyrics": None, 
-            "hiragana_lyrics": None, 
-            "word_mapping": None, 
-            "kanji_data": all_kanji_data, 
-            "image_url": image_url
-            }).execute()
-        except Exception as e:
-            return {"message": f"An error occurred while inserting the song data: {str(e)}"}
-        
-        # send to SQS
-        body = {
-            "song": title,
-            "artist": artist,
-            "cleaned_lyrics": cleaned_lyrics,
-            "access_token": access_token,
-            "refresh_token": refresh_token
-        }
-        sqs = aws_session.resource('sqs')
-        queue = sqs.Queue(sqs_url)
-        queue.send_message(
-            MessageBody=json.dumps(body)
-        )
+    lyrics_source = None
+    in_table = await find_song_data(key)
+    if in_table is None:
+        async def ingest():
+            # Retrieve song data if it exists
+            lyrics, lyrics_source = await get_lyrics(artist, title, user_agent)
+            
+            if lyrics is None:
+                return {"message": "No lyrics found for this song."}, lyrics_source
+            
+            image_url = await offload("spotify", get_image_from_spotify, artist, title)
+
+            # Preparing for SQS send and getting Kanji
+            cleaned_lyrics = clean_lyrics(lyrics, artist)
+            if cleaned_lyrics is None:
+                return {"message": "No Japanese lyrics found for this song. Paste the lyrics in."}, lyrics_source
+            kanji_list = extract_unicode_block(CONST_KANJI, cleaned_lyrics)
+            if not kanji_list:
+                return {"message": "Error! Seems like we can't get the lyrics from the search. Paste the lyrics in."}, lyrics_source
+            all_kanji_data = get_all_kanji_data(kanji_list)
+
+            await finish_ingest(title, artist, cleaned_lyrics, all_kanji_data, image_url)
+            return None, lyrics_source
+
+        message, lyrics_source = await ingest_once(title, artist, ingest)
+        if message is not None:
+            return message
+        in_table = await find_song_data(key) or {"title": title, "artist": artist}
 
     # Song has been successfully added to the global database, now add for the specific user
-    response = supabase.table("Song").insert({"title": title, "artist": artist, "id": user.id}).execute()
+    response = await offload("supabase", supabase.table("Song").insert({"title": in_table["title"], "artist": in_table["artist"], "song_key": key, "id": user.id}).execute)
     # print(response)
-    return {"message": "Song added successfully.", "status": "success"}
+    return {"message": "Song added successfully.", "status": "success", "lyrics_source": lyrics_source}
   
     
    
@@ -425,68 +598,153 @@ async def add_song_manual(manual: ManualAdd, user: User = Depends(get_current_us
     title = manual.title
     artist = manual.artist
     lyrics = manual.lyrics
-    refresh_token = manual.refresh_token
-    access_token = manual.access_token
     if manual is None or user is None:
         return {"message": "Missing information. Please try again."}
-    in_my_table = supabase.table("Song").select(count="exact").eq("title", title).eq("artist", artist).eq("id", user.id).execute().count
+    key = song_key(title, artist)
+    in_my_table = (await offload("supabase", supabase.table("Song").select(count="exact").eq("song_key", key).eq("id", user.id).execute)).count
     if in_my_table > 0:
         return {"message": "Song already in database."}
     
-    in_table = supabase.table("SongData").select(count="exact").eq("title", title).eq("artist", artist).execute().count
-    if not in_table:
+    in_table = await find_song_data(key)
+    if in_table is None:
         # song not in global database
-        image_url = get_image_from_spotify(artist, title)
-        cleaned_lyrics = clean_lyrics(lyrics, artist)
-        if cleaned_lyrics is None:
-            return {"message": "No Japanese lyrics found here. Check your input."}
-        kanji_list = extract_unicode_block(CONST_KANJI, cleaned_lyrics)
-        if not kanji_list:
-            return {"message": "Error! Check your input. No Japanese found in the lyrics."}
-        all_kanji_data = get_all_kanji_data(kanji_list)
-        
-        try:
-            response = supabase.table("SongData").insert({
-            "title": title, 
-            "artist": artist, 
-            "lyrics": None, 
-            "hiragana_lyrics": None, 
-            "word_mapping": None, 
-            "kanji_data": all_kanji_data, 
-            "image_url": image_url
-            }).execute()
-        except Exception as e:
-            return {"message": f"An error occurred while inserting the song data: {str(e)}"}
-        
-        # call long running SQS to process tokenized lines and add it to the database
-        # send to SQS
-        body = {
-            "song": title,
-            "artist": artist,
-            "cleaned_lyrics": cleaned_lyrics,
-            "access_token": access_token,
-            "refresh_token": refresh_token
-        }
-        sqs = aws_session.resource('sqs')
-        queue = sqs.Queue(sqs_url)
-        queue.send_message(
-            MessageBody=json.dumps(body)
-        )
-    response = supabase.table("Song").insert({"title": title, "artist": artist, "id": user.id}).execute()
+        async def ingest():
+            image_url = await offload("spotify", get_image_from_spotify, artist, title)
+            cleaned_lyrics = clean_lyrics(lyrics, artist)
+            if cleaned_lyrics is None:
+                return {"message": "No Japanese lyrics found here. Check your input."}, None
+            kanji_list = extract_unicode_block(CONST_KANJI, cleaned_lyrics)
+            if not kanji_list:
+                return {"message": "Error! Check your input. No Japanese found in the lyrics."}, None
+            all_kanji_data = get_all_kanji_data(kanji_list)
+
+            # call long running SQS to process tokenized lines and add it to the database
+            await finish_ingest(title, artist, cleaned_lyrics, all_kanji_data, image_url)
+            return None, None
+
+        message, _ = await ingest_once(title, artist, ingest)
+        if message is not None:
+            return message
+        in_table = await find_song_data(key) or {"title": title, "artist": artist}
+    response = await offload("supabase", supabase.table("Song").insert({"title": in_table["title"], "artist": in_table["artist"], "song_key": key, "id": user.id}).execute)
     return response
 
 #need a route which provides a desired song from the database when requested. provides the lyrics and the mapping of word to idseq and kanji dictionary.
+# Processed songs are served from the body the worker stored (precompressed when the client accepts it) with an ETag, so reopened songs get a 304.
 @router.get("/get-song")
-async def get_song(title: str = None, artist: str = None, user: User = Depends(get_current_user)):
+async def get_song(request: Request, title: str = None, artist: str = None, user: User = Depends(get_current_user)):
     if title is None or artist is None or user is None:
         return {"message": "Missing information. Please try again."}
     else:
         # have access to title, artist, uuid
-        response = supabase.table("SongData").select("lyrics, hiragana_lyrics, word_mapping, kanji_data").eq("title", title).eq("artist", artist).execute()
-        if response.count == 0:
+        key = song_key(title, artist)
+        if_none_match = request.headers.get("if-none-match")
+        headers = {"Vary": "Accept-Encoding", "Cache-Control": "private, no-cache"}
+        if if_none_match:
+            # a revalidation reads only the current ETag first, so a 304 doesn't pull the body out of the database.
+            # It is always read from the row: a reprocessed song gets a new one, which no process could know about.
+            response = await offload("supabase", supabase.table("SongData").select("payload_etag").eq("song_key", key).execute)
+            if not response.data:
+                return {"message": "Song not found in database."}
+            etag = response.data[0]["payload_etag"]
+            if etag is not None and etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag, **headers})
+
+        accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+        columns = [column for encoding, column in PAYLOAD_ENCODINGS if encoding in accepted or column == "payload_gzip"]
+        response = await offload("supabase", supabase.table("SongData").select(", ".join(["payload_etag"] + columns)).eq("song_key", key).execute)
+        if not response.data:
             return {"message": "Song not found in database."}
+        stored = response.data[0]
+        encoding, column = choose_payload(accepted, stored)
+        if stored["payload_etag"] is None or stored[column] is None:
+            # not processed yet, or processed without a stored payload (see scripts.backfillPayloads)
+            response = await offload("supabase", supabase.table("SongData").select("lyrics, hiragana_lyrics, word_mapping, word_refs, kanji_data").eq("song_key", key).execute)
+            return await with_word_mapping(response.data[0])
+
+        headers["ETag"] = stored["payload_etag"]
+        if if_none_match and etag_matches(if_none_match, stored["payload_etag"]):
+            # the payload changed between the two reads and is now the one the client has
+            return Response(status_code=304, headers=headers)
+        body = base64.b64decode(stored[column])
+        if encoding:
+            headers["Content-Encoding"] = encoding
         else:
-            return response.data[0]
+            body = gzip.decompress(body)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+#need a route which provides part of a song: lines [start, start + count) with only the word_mapping and kanji_data entries those lines use.
+@router.get("/get-song-lines")
+async def get_song_lines(title: str = None, artist: str = None, start: int = 0, count: int = 40, user: User = Depends(get_current_user)):
+    if title is None or artist is None or user is None:
+        return {"message": "Missing information. Please try again."}
+    if start < 0 or count < 1 or count > MAX_SONG_LINES:
+        return {"message": f"Request between 1 and {MAX_SONG_LINES} lines from a non-negative start."}
+    song = await load_song(title, artist)
+    if song is None:
+        return {"message": "Song not found in database."}
+    if song["lyrics"] is None:
+        return {"message": "Song is still being processed."}
+
+    lines = song["lyrics"][start:start + count]
+    words = {token for line in lines for token in line}
+    kanji = set(extract_unicode_block(CONST_KANJI, "".join(words)))
+    word_mapping = song["word_mapping"] or {}
+    kanji_data = song["kanji_data"] or {}
+    return {
+        "start": start,
+        "total_lines": len(song["lyrics"]),
+        "lyrics": lines,
+        "hiragana_lyrics": (song["hiragana_lyrics"] or [])[start:start + count],
+        "word_mapping": {word: word_mapping[word] for word in words if word in word_mapping},
+        "kanji_data": {k: kanji_data[k] for k in kanji if k in kanji_data}
+    }
+
+#companion to get-song-lines: fetches further word_mapping entries on demand
+@router.post("/get-word-entries")
+async def get_word_entries(wordEntries: WordEntries, user: User = Depends(get_current_user)):
+    if len(wordEntries.words) > MAX_WORD_ENTRIES:
+        return {"message": f"Too many words. Send at most {MAX_WORD_ENTRIES} at a time."}
+    song = await load_song(wordEntries.title, wordEntries.artist)
+    if song is None:
+        return {"message": "Song not found in database."}
+    word_mapping = song["word_mapping"] or {}
+    return {word: word_mapping[word] for word in wordEntries.words if word in word_mapping}
+
+#need a route which provides a song with word_refs in place of word_mapping: every word entry is an id, fetched through get-entries.
+# Entries are shared between songs and never change, so a client that keeps them only downloads each one once.
+@router.get("/get-song-refs")
+async def get_song_refs(title: str = None, artist: str = None, user: User = Depends(get_current_user)):
+    if title is None or artist is None or user is None:
+        return {"message": "Missing information. Please try again."}
+    response = await offload("supabase", supabase.table("SongData").select("lyrics, hiragana_lyrics, word_mapping, word_refs, kanji_data").eq("song_key", song_key(title, artist)).execute)
+    if not response.data:
+        return {"message": "Song not found in database."}
+    song = response.data[0]
+    if song["lyrics"] is None:
+        return {"message": "Song is still being processed."}
+    result = {"lyrics": song["lyrics"], "hiragana_lyrics": song["hiragana_lyrics"], "word_refs": song["word_refs"], "kanji_data": song["kanji_data"]}
+    if song["word_refs"] is None:
+        # processed before entries were shared: they aren't in WordEntry yet, so they come with the song
+        result["word_refs"], result["entries"] = split_word_mapping(song["word_mapping"] or {})
+    return result
+
+#companion to get-song-refs: word entries by id
+@router.post("/get-entries")
+async def get_word_entries_by_id(entryIds: EntryIds, user: User = Depends(get_current_user)):
+    if len(entryIds.ids) > MAX_ENTRY_IDS:
+        return {"message": f"Too many entries. Send at most {MAX_ENTRY_IDS} ids at a time."}
+    return await offload("supabase", get_entries, supabase, list(dict.fromkeys(entryIds.ids)))
+
+#need a route which searches the songs already in the database by title or artist: partial, misspelled, kana or romaji input all work.
+# Meant to be tried before adding a song through Spotify or Genius. Results are ranked best first.
+@router.get("/search")
+async def search_songs(q: str = None, limit: int = 20, user: User = Depends(get_current_user)):
+    if not q or not q.strip() or user is None:
+        return {"message": "Missing information. Please try again."}
+    query, reading = search_queries(q)
+    response = await offload("supabase", supabase.rpc("search_songs", {"query": query, "reading": reading, "max_results": min(max(limit, 1), MAX_SEARCH_RESULTS)}).execute)
+    return [{"title": row["title"], "artist": row["artist"], "SongData": {"image_url": row["image_url"]}, "score": row["score"]} for row in response.data]
 
 #need a route which looks up a particular idseq in jamdict.
 @router.get("/get-word")
@@ -506,7 +764,7 @@ async def get_hiragana(title: str = None, artist: str = None, user: User = Depen
     if title is None or artist is None or user is None:
         return {"message": "Missing information. Please try again."}
     else:
-        response = supabase.table("SongData").select("hiragana_lyrics").eq("title", title).eq("artist", artist).execute()
+        response = await offload("supabase", supabase.table("SongData").select("hiragana_lyrics").eq("song_key", song_key(title, artist)).execute)
         if response.count == 0:
             return {"message": "Song not found in database."}
         else:
@@ -515,20 +773,46 @@ async def get_hiragana(title: str = None, artist: str = None, user: User = Depen
 #need a route which provides a list of songs from the database when requested for the particular user.
 @router.get("/get-songs")
 async def get_songs(user: User = Depends(get_current_user)):
-    response = supabase.table("Song").select("title, artist, SongData(image_url)").eq("id", user.id).execute()
+    response = await offload("supabase", supabase.table("Song").select("title, artist, SongData(image_url)").eq("id", user.id).execute)
     if not response.data :
         return {"message": "No songs found in database."}
     else:
         return response.data
 
 
+# Newest first. Pages are keyset based: pass the X-Next-Cursor header of one page as `cursor` to get the next.
+# distinct=true lists each song once (from SongData) instead of once per user who added it. `offset` is still accepted for old clients.
 @router.get("/get-global-songs")
-async def get_global_songs(limit: int = 50, offset: int = 0, user: User = Depends(get_current_user)):
+async def get_global_songs(response: Response, limit: int = 50, offset: int = 0, cursor: str = None, distinct: bool = False, user: User = Depends(get_current_user)):
     if limit == None or offset == None:
         return {"message": "Missing information. Please try again."}
     else:
-        response = supabase.table("Song").select("title, artist, SongData(image_url)").limit(limit).offset(offset).order("created_at", desc=True).execute()
-        return response.data
+        if distinct:
+            table, select, keys = "SongData", "title, artist, image_url, created_at", ("created_at", "title", "artist")
+        else:
+            # seq rather than id (the adding user's UUID) breaks ties, so cursors don't carry user ids
+            table, select, keys = "Song", "title, artist, SongData(image_url), created_at, seq", ("created_at", "seq")
+        query = supabase.table(table).select(select)
+        for key in keys:
+            query = query.order(key, desc=True)
+        if cursor is not None:
+            try:
+                values = decode_cursor(cursor, len(keys))
+            except ValueError:
+                return {"message": "Invalid cursor."}
+            if not distinct and not isinstance(values[1], int):
+                # a cursor from before seq, or a made up one
+                return {"message": "Invalid cursor."}
+            query = query.or_(keyset_filter(keys, values))
+        elif offset:
+            query = query.offset(offset)
+        rows = (await offload("supabase", query.limit(limit).execute)).data
+
+        if len(rows) == limit:
+            response.headers["X-Next-Cursor"] = encode_cursor([rows[-1][key] for key in keys])
+        if distinct:
+            return [{"title": row["title"], "artist": row["artist"], "SongData": {"image_url": row["image_url"]}} for row in rows]
+        return [{"title": row["title"], "artist": row["artist"], "SongData": row["SongData"]} for row in rows]
     
 #TODO: add a get image url function that takes title and artist and distinctly returns an image url.
 @router.get("/get-image")
@@ -536,7 +820,7 @@ async def get_image(title: str = None, artist: str = None, user: User = Depends(
     if title is None or artist is None or user is None:
         return {"message": "Missing information. Please try again."}
     else:
-        response = supabase.table("SongData").select("image_url").eq("title", title).eq("artist", artist).limit(1).execute()
+        response = await offload("supabase", supabase.table("SongData").select("image_url").eq("song_key", song_key(title, artist)).limit(1).execute)
         if response.count == 0:
             return {"message": "Song not found in database."}
         else:
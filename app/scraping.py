@@ -0,0 +1,231 @@
+import os
+import threading
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
+from app.offload import offload
+
+# how many Chrome sessions may be alive at once, and how many pages a session serves before it is replaced
+CHROME_POOL_SIZE = int(os.getenv("CHROME_POOL_SIZE", "2"))
+CHROME_MAX_PAGES = int(os.getenv("CHROME_MAX_PAGES", "25"))
+
+_chromedriver_path = None
+
+# lxml is much faster than the builtin parser, but html.parser works when it is not installed
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+LYRICS_CONTAINERS = SoupStrainer("div", attrs={"data-lyrics-container": "true"})
+
+# one pooled HTTP session for every Genius page fetch
+http = requests.Session()
+http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+# a page that couldn't be read (timeout, non-200 response, browser error), as opposed to one without lyrics
+class ScrapeError(Exception):
+    pass
+
+
+def chromedriver_path():
+    # the docker image resolves chromedriver at build time (CHROMEDRIVER_PATH); webdriver_manager is only a local fallback
+    global _chromedriver_path
+    if _chromedriver_path is None:
+        _chromedriver_path = os.getenv("CHROMEDRIVER_PATH")
+        if not _chromedriver_path:
+            from webdriver_manager.chrome import ChromeDriverManager
+            _chromedriver_path = ChromeDriverManager().install()
+    return _chromedriver_path
+
+
+def create_driver():
+    # selenium is only imported once a page actually needs Chrome
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.chrome.options import Options
+
+    options = Options()
+    options.add_argument("--headless")  # Run in headless mode
+    options.add_argument("--disable-blink-features=AutomationControlled")
+    options.add_argument("--disable-infobars")
+    options.add_argument("--disable-extensions")
+
+    # 🚀 **Speed Boost: Block images & scripts**
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,  # Disable images
+        "profile.managed_default_content_settings.stylesheets": 2,  # Disable CSS
+        "profile.managed_default_content_settings.javascript": 1,  # Keep JS enabled
+    })
+
+    service = Service(chromedriver_path())
+    return webdriver.Chrome(service=service, options=options)
+
+
+class PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+
+
+'''
+A bounded pool of warm headless Chrome sessions. Starting Chrome is the slowest part of scraping, so
+sessions are kept between requests (and between warm Lambda invocations, since the pool is module level).
+Idle sessions are health checked before reuse and replaced after CHROME_MAX_PAGES pages.
+'''
+class DriverPool:
+    def __init__(self, size=CHROME_POOL_SIZE, max_pages=CHROME_MAX_PAGES):
+        self.size = size
+        self.max_pages = max_pages
+        self.idle = []
+        self.created = 0
+        self.condition = threading.Condition()
+
+    def _healthy(self, pooled):
+        try:
+            return pooled.driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def _discard(self, pooled):
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            print("Error closing Chrome session:", e)
+        with self.condition:
+            self.created -= 1
+            self.condition.notify()
+
+    def acquire(self, timeout=30):
+        while True:
+            with self.condition:
+                if not self.idle and self.created >= self.size:
+                    if not self.condition.wait_for(lambda: self.idle or self.created < self.size, timeout=timeout):
+                        raise TimeoutError("No Chrome session became available.")
+                if self.idle:
+                    pooled = self.idle.pop()
+                else:
+                    self.created += 1
+                    pooled = None
+            if pooled is None:
+                try:
+                    return PooledDriver(create_driver())
+                except Exception:
+                    with self.condition:
+                        self.created -= 1
+                        self.condition.notify()
+                    raise
+            if self._healthy(pooled):
+                return pooled
+            self._discard(pooled)
+
+    def release(self, pooled):
+        pooled.pages += 1
+        if pooled.pages >= self.max_pages or not self._healthy(pooled):
+            self._discard(pooled)
+            return
+        with self.condition:
+            self.idle.append(pooled)
+            self.condition.notify()
+
+    @contextmanager
+    def driver(self):
+        pooled = self.acquire()
+        try:
+            yield pooled.driver
+        finally:
+            self.release(pooled)
+
+    def close(self):
+        with self.condition:
+            idle, self.idle = self.idle, []
+        for pooled in idle:
+            self._discard(pooled)
+
+
+driver_pool = DriverPool()
+
+
+def scrape_lyrics_with_selenium(url, user_agent):
+    """Scrape lyrics from Genius using a pooled Chrome session. Raises ScrapeError when the page can't be loaded."""
+    try:
+        from selenium.common.exceptions import TimeoutException
+        with driver_pool.driver() as driver:
+            # sessions are shared, so per-request state is set (and cleared) on every page
+            if user_agent:
+                driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": user_agent})
+            driver.delete_all_cookies()
+            driver.get(url) # Allow page to load
+
+            from selenium.webdriver.common.by import By
+            from selenium.webdriver.support.ui import WebDriverWait
+            from selenium.webdriver.support import expected_conditions as EC
+
+            # Find all divs where data-lyrics-container="true"
+            try:
+                lyrics_elements = WebDriverWait(driver, 5).until(
+                    EC.presence_of_all_elements_located((By.XPATH, '//div[@data-lyrics-container="true"]'))
+                )
+            except TimeoutException:
+                # the page loaded but has no lyrics containers
+                return None
+
+            lyrics = "\n".join([elem.text for elem in lyrics_elements if elem.text.strip()])
+            return lyrics
+
+    except Exception as e:
+        raise ScrapeError(f"Error scraping lyrics: {e}") from e
+
+
+def extract_lyrics_from_html(html):
+    """
+    Pull the lyrics out of a server-rendered Genius page.
+
+    Args:
+        html: Page HTML
+
+    Returns:
+        The text of every data-lyrics-container div, laid out like Selenium's element text, or None
+    """
+    # only the lyrics containers are parsed, the rest of the page is skipped
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=LYRICS_CONTAINERS)
+    parts = []
+    for container in soup.find_all("div", attrs={"data-lyrics-container": "true"}):
+        for br in container.find_all("br"):
+            br.replace_with("\n")
+        text = container.get_text().strip()
+        if text:
+            parts.append(text)
+    return "\n".join(parts) or None
+
+
+def scrape_lyrics_with_http(url, user_agent):
+    """Fetch a Genius page over plain HTTP and extract the lyrics without a browser. Raises ScrapeError unless the page is a 200."""
+    try:
+        response = http.get(url, headers={"User-Agent": user_agent or DEFAULT_USER_AGENT}, timeout=10)
+    except requests.RequestException as e:
+        raise ScrapeError(f"Error fetching lyrics page: {e}") from e
+    if response.status_code != 200:
+        raise ScrapeError(f"Genius returned {response.status_code} for {url}")
+    return extract_lyrics_from_html(response.text)
+
+
+# tries plain HTTP first and only starts a browser when that fails. Returns (lyrics, source) where source is "http", "selenium" or None.
+# (None, None) means the browser read the page and it has no lyrics; if the browser couldn't read it, ScrapeError is raised.
+async def fetch_lyrics(url, user_agent):
+    try:
+        lyrics = await offload("genius", scrape_lyrics_with_http, url, user_agent)
+    except ScrapeError as e:
+        print(e)
+        lyrics = None
+    source = "http" if lyrics else None
+    if not lyrics:
+        lyrics = await offload("selenium", scrape_lyrics_with_selenium, url, user_agent)
+        source = "selenium" if lyrics else None
+    print(f"Lyrics for {url} served by {source}")
+    return lyrics, source
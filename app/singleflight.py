@@ -0,0 +1,44 @@
+import asyncio
+
+'''
+In-process request coalescing. While a call for a key is running, further calls for the same key
+wait for its result instead of starting their own:
+
+    result = await ingests.do(key, ingest)
+
+Only coalesces within one process; callers that need a guarantee across processes (or Lambda
+instances) still need a database-level claim.
+'''
+
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, fn, *args, **kwargs):
+        """
+        Run `await fn(*args, **kwargs)` unless a call for `key` is already in flight.
+
+        The work runs in its own task, so a caller that is cancelled (e.g. its client disconnected) only stops
+        waiting; the work carries on for everyone else, including the caller that started it.
+
+        Args:
+            key: Hashable identity of the work
+            fn: Coroutine function doing the work
+
+        Returns:
+            The result of the shared call. If it raised, every waiting caller raises the same exception.
+        """
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(fn(*args, **kwargs))
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            # marks the exception as retrieved when every caller had gone
+            task.exception()
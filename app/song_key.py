@@ -0,0 +1,30 @@
+import re
+import unicodedata
+
+'''
+Canonical identity of a song, stored as SongData.song_key and Song.song_key (both indexed), so that
+dedupe is an indexed equality lookup instead of comparing raw titles or pattern matching.
+
+Title and artist are NFKC normalized (which folds full/half width forms), stripped of "feat." credits
+and bracketed annotations, case folded and whitespace collapsed:
+
+    song_key("Lemon (Official Audio)", "米津玄師") == song_key("ｌｅｍｏｎ", "米津玄師")
+'''
+
+# "feat. X", "ft. X", "featuring X" up to the end, optionally opened by a bracket
+FEATURING = re.compile(r"[\s(\[（【]*\b(?:feat\.?|ft\.|featuring)\s.*$", re.IGNORECASE)
+BRACKETED = re.compile(r"[(\[（【〔][^)\]）】〕]*[)\]）】〕]")
+SEPARATOR = "\x1f"
+
+
+def normalize_part(text):
+    text = unicodedata.normalize("NFKC", text or "")
+    stripped = BRACKETED.sub(" ", FEATURING.sub("", text))
+    # names that are nothing but brackets (e.g. "[Alexandros]") keep their text
+    if stripped.strip():
+        text = stripped
+    return " ".join(text.casefold().split())
+
+
+def song_key(title, artist):
+    return normalize_part(artist) + SEPARATOR + normalize_part(title)
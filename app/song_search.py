@@ -0,0 +1,55 @@
+from app.song_key import normalize_part
+from app.timing import timer
+
+'''
+Text for the SongData catalog search (the search_songs RPC, a pg_trgm index over SongData.search_text).
+
+A song's search text holds its normalized title and artist plus their hiragana and romaji readings, so
+"yoru ni kakeru", "よるにかける" and "夜に駆ける" all find the same song. Trigram similarity on top of
+that gives partial matches and typo tolerance.
+'''
+
+kakasi = None
+
+
+def get_kakasi():
+    # created on first use (and shared with the song router), so importing the router doesn't load pykakasi's dictionaries
+    global kakasi
+    if kakasi is None:
+        with timer("init-kakasi"):
+            import pykakasi
+            kakasi = pykakasi.kakasi()
+    return kakasi
+
+
+def readings(text):
+    # (hiragana, romaji) reading of normalized text
+    segments = get_kakasi().convert(text)
+    hiragana = "".join(segment["hira"] for segment in segments)
+    romaji = " ".join(segment["hepburn"] for segment in segments if segment["hepburn"].strip())
+    return hiragana, " ".join(romaji.split())
+
+
+def build_search_text(title, artist):
+    parts = {}
+    for text in (normalize_part(title), normalize_part(artist)):
+        hiragana, romaji = readings(text)
+        for part in (text, hiragana, romaji.casefold()):
+            # readings that only differ by spacing (e.g. of latin text) are kept once
+            parts.setdefault(part.replace(" ", ""), part)
+    return " ".join(part for part in parts.values() if part)
+
+
+def search_queries(query):
+    """
+    Forms of a user's query to match against search text.
+
+    Args:
+        query: Raw search input
+
+    Returns:
+        (normalized query, hiragana reading or None when it is the same text)
+    """
+    text = normalize_part(query)
+    hiragana, _ = readings(text)
+    return text, hiragana if hiragana != text else None
@@ -0,0 +1,190 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+'''
+Long-lived producer for the lyric processing queue.
+
+Messages are sent with send_message_batch (up to 10 per call), using one SQS client for the life of
+the process instead of a new resource per request. send() flushes straight away: a Lambda instance can
+be frozen as soon as its response is returned, so a message held back for a fuller batch might not go
+out until the next request. That means a batch only holds more than one message when sends from
+concurrent requests land in the same flush, when stale outbox rows are re-sent with it, or when a
+caller enqueue()s several messages before one flush().
+
+Before a message is sent it is written to the "SqsOutbox" table and the row is deleted once SQS accepts
+it, so a failed send leaves a row that a later flush picks up again instead of a song stuck at
+`lyrics: None`. Every outbox row is sent to the worker, which writes with the service role, so the table
+has no RLS policies and no user can read or add rows; it is written with a service role client. Rows
+left by an instance that went away are re-sent by the scheduled flush (see flush_outbox in app/main.py).
+
+QUEUE_BACKEND=memory swaps SQS for MemoryQueue, which keeps sent messages in a list for local runs
+and tests:
+
+    producer = SqsProducer(MemoryQueue())
+    producer.send({"song": ...})
+    producer.queue.messages
+'''
+
+# SQS limits for one send_message_batch call
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+# outbox rows older than this are assumed lost and re-sent, at most once per interval per process
+OUTBOX_RETRY_SECONDS = int(os.getenv("OUTBOX_RETRY_SECONDS", "300"))
+
+
+class MemoryQueue:
+    def __init__(self):
+        self.messages = []
+
+    def send_message_batch(self, Entries):
+        self.messages.extend(json.loads(entry["MessageBody"]) for entry in Entries)
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+
+class SqsQueue:
+    def __init__(self, url, session):
+        self.url = url
+        self.client = session.client("sqs")
+
+    def send_message_batch(self, Entries):
+        return self.client.send_message_batch(QueueUrl=self.url, Entries=Entries)
+
+
+class Outbox:
+    def __init__(self, supabase, table="SqsOutbox"):
+        self.supabase = supabase
+        self.table = table
+
+    def add(self, body):
+        response = self.supabase.table(self.table).insert({"body": body}).execute()
+        return response.data[0]["id"]
+
+    def remove(self, ids):
+        self.supabase.table(self.table).delete().in_("id", ids).execute()
+
+    def mark_failed(self, ids, error):
+        self.supabase.table(self.table).update({"last_error": error}).in_("id", ids).execute()
+
+    def stale(self, older_than, limit=100):
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=older_than)).isoformat()
+        response = self.supabase.table(self.table).select("id, body").lt("created_at", cutoff).order("created_at").limit(limit).execute()
+        return response.data
+
+
+class SqsProducer:
+    def __init__(self, queue, outbox=None, retry_seconds=OUTBOX_RETRY_SECONDS):
+        self.queue = queue
+        self.outbox = outbox
+        self.retry_seconds = retry_seconds
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.last_retry = time.monotonic()
+        self.sequence = 0
+
+    def enqueue(self, body):
+        # records the message in the outbox and buffers it until the next flush
+        outbox_id = None
+        if self.outbox is not None:
+            try:
+                outbox_id = self.outbox.add(body)
+            except Exception as e:
+                # without an outbox row the message is still sent, it just can't be retried
+                print(f"Could not write outbox row: {e}")
+        with self.lock:
+            self.sequence += 1
+            entry_id = f"o{outbox_id}" if outbox_id is not None else f"m{self.sequence}"
+            self.buffer.append((entry_id, outbox_id, body))
+
+    def flush(self, retry_outbox=False):
+        """
+        Send every buffered message, plus any stale outbox rows, with send_message_batch.
+
+        Args:
+            retry_outbox: Read stale outbox rows now, instead of at most once per retry interval
+
+        Returns:
+            Number of messages SQS accepted
+        """
+        with self.lock:
+            pending, self.buffer = self.buffer, []
+        pending += self._stale_outbox_rows(pending, retry_outbox)
+
+        sent = 0
+        for batch in self._batches(pending):
+            outbox_ids = {entry_id: outbox_id for entry_id, outbox_id, _ in batch}
+            entries = [{"Id": entry_id, "MessageBody": json.dumps(body)} for entry_id, _, body in batch]
+            try:
+                response = self.queue.send_message_batch(Entries=entries)
+                succeeded = [entry["Id"] for entry in response.get("Successful", [])]
+                failed = response.get("Failed", [])
+                error = "; ".join(f"{entry.get('Code')}: {entry.get('Message')}" for entry in failed)
+            except Exception as e:
+                succeeded = []
+                failed = entries
+                error = str(e)
+            sent += len(succeeded)
+            if failed:
+                print(f"Failed to send {len(failed)} queue messages: {error}")
+            self._settle(
+                [outbox_ids[entry_id] for entry_id in succeeded if outbox_ids[entry_id] is not None],
+                [outbox_ids[entry["Id"]] for entry in failed if outbox_ids[entry["Id"]] is not None],
+                error,
+            )
+        return sent
+
+    def send(self, body):
+        # enqueue and flush in one call, for a single message sent from a request
+        self.enqueue(body)
+        return self.flush()
+
+    def _stale_outbox_rows(self, pending, force=False):
+        if self.outbox is None or (not force and time.monotonic() - self.last_retry < self.retry_seconds):
+            return []
+        self.last_retry = time.monotonic()
+        buffered = {outbox_id for _, outbox_id, _ in pending}
+        try:
+            rows = self.outbox.stale(self.retry_seconds)
+        except Exception as e:
+            print(f"Could not read outbox: {e}")
+            return []
+        return [(f"o{row['id']}", row["id"], row["body"]) for row in rows if row["id"] not in buffered]
+
+    def _batches(self, pending):
+        # splits messages by SQS's per-call entry count and payload size limits
+        batch = []
+        size = 0
+        for item in pending:
+            item_size = len(json.dumps(item[2]).encode("utf-8"))
+            if batch and (len(batch) == MAX_BATCH_ENTRIES or size + item_size > MAX_BATCH_BYTES):
+                yield batch
+                batch = []
+                size = 0
+            batch.append(item)
+            size += item_size
+        if batch:
+            yield batch
+
+    def _settle(self, sent_ids, failed_ids, error):
+        if self.outbox is None:
+            return
+        try:
+            if sent_ids:
+                self.outbox.remove(sent_ids)
+            if failed_ids:
+                self.outbox.mark_failed(failed_ids, error)
+        except Exception as e:
+            # a leftover row only means the message may be sent twice; the worker's update is idempotent
+            print(f"Could not update outbox: {e}")
+
+
+# `supabase` is a service role client (db.supabase.create_service_client); without one, messages are sent without an outbox
+def create_producer(queue_url, aws_session, supabase):
+    if os.getenv("QUEUE_BACKEND") == "memory":
+        return SqsProducer(MemoryQueue())
+    if supabase is None:
+        print("SUPABASE_SERVICE_ROLE_KEY is not set; queue messages are sent without an outbox and can't be retried")
+        return SqsProducer(SqsQueue(queue_url, aws_session))
+    return SqsProducer(SqsQueue(queue_url, aws_session), outbox=Outbox(supabase))
@@ -0,0 +1,61 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+'''
+Per-request stage timings, reported in the Server-Timing response header.
+
+ServerTimingMiddleware gives every request its own timings dict (through a context variable, which
+anyio copies into offload() threads), and code on the hot paths wraps work in timer():
+
+    with timer("clean-lyrics"):
+        cleaned_lyrics = clean_lyrics(lyrics, artist)
+
+A name used more than once in a request adds up, e.g. every Supabase round trip goes into "supabase".
+'''
+
+_timings = ContextVar("timings", default=None)
+
+
+@contextmanager
+def timer(name):
+    timings = _timings.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            total, count = timings.get(name, (0.0, 0))
+            timings[name] = (total + time.perf_counter() - start, count + 1)
+
+
+def server_timing_header(timings, total):
+    entries = [f"{name};dur={seconds * 1000:.1f};desc=\"x{count}\"" for name, (seconds, count) in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class ServerTimingMiddleware:
+    # plain ASGI middleware, so the timings context is shared with the route handler (and its threads)
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = {}
+        token = _timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                header = server_timing_header(timings, time.perf_counter() - start)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
@@ -0,0 +1,17 @@
+-- Bulk update used by the lyric processing worker, so a whole SQS batch is written in one round trip.
+-- rows: [{"title", "artist", "lyrics", "hiragana_lyrics", "word_mapping"}, ...]
+create or replace function update_song_data_batch(rows jsonb)
+returns integer
+language sql
+as $$
+  with updated as (
+    update "SongData" as s
+    set lyrics = r.lyrics,
+        hiragana_lyrics = r.hiragana_lyrics,
+        word_mapping = r.word_mapping
+    from jsonb_to_recordset(rows) as r(title text, artist text, lyrics jsonb, hiragana_lyrics jsonb, word_mapping jsonb)
+    where s.title = r.title and s.artist = r.artist
+    returning 1
+  )
+  select count(*)::integer from updated;
+$$;
@@ -0,0 +1,12 @@
+-- One SongData row per (title, artist). The API inserts the placeholder row as a claim before scraping,
+-- so concurrent adds of the same song from different instances can't both do the work.
+
+-- keep a single row for any existing duplicates, preferring one the worker has already filled in
+delete from "SongData" as a
+using "SongData" as b
+where a.title = b.title
+  and a.artist = b.artist
+  and a.ctid <> b.ctid
+  and (a.word_mapping is null, a.ctid) > (b.word_mapping is null, b.ctid);
+
+create unique index if not exists songdata_title_artist_key on "SongData" (title, artist);
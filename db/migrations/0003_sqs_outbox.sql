@@ -0,0 +1,14 @@
+-- Queue messages waiting to be (re)sent to the lyric processing queue. The API writes a row before each
+-- send and deletes it once SQS accepts the message; rows left behind are re-sent by a later flush.
+-- Every row becomes work for the lyric processing worker, so row level security is on with no policies:
+-- only the service role key can use this table, and users can't read or add messages.
+create table if not exists "SqsOutbox" (
+  id bigint generated always as identity primary key,
+  body jsonb not null,
+  created_at timestamptz not null default now(),
+  last_error text
+);
+
+create index if not exists sqsoutbox_created_at_idx on "SqsOutbox" (created_at);
+
+alter table "SqsOutbox" enable row level security;
@@ -0,0 +1,32 @@
+-- Precomputed /song/get-song response bodies, written by the lyric processing worker.
+-- payload is the JSON body, payload_gzip and payload_br are base64 encoded compressed copies of it
+-- (payload_br is null when the worker has no brotli), and payload_etag is the body's content hash.
+alter table "SongData"
+  add column if not exists payload text,
+  add column if not exists payload_gzip text,
+  add column if not exists payload_br text,
+  add column if not exists payload_etag text;
+
+-- rows: [{"title", "artist", "lyrics", "hiragana_lyrics", "word_mapping", "payload", "payload_gzip", "payload_br", "payload_etag"}, ...]
+create or replace function update_song_data_batch(rows jsonb)
+returns integer
+language sql
+as $$
+  with updated as (
+    update "SongData" as s
+    set lyrics = r.lyrics,
+        hiragana_lyrics = r.hiragana_lyrics,
+        word_mapping = r.word_mapping,
+        payload = r.payload,
+        payload_gzip = r.payload_gzip,
+        payload_br = r.payload_br,
+        payload_etag = r.payload_etag
+    from jsonb_to_recordset(rows) as r(
+      title text, artist text, lyrics jsonb, hiragana_lyrics jsonb, word_mapping jsonb,
+      payload text, payload_gzip text, payload_br text, payload_etag text
+    )
+    where s.title = r.title and s.artist = r.artist
+    returning 1
+  )
+  select count(*)::integer from updated;
+$$;
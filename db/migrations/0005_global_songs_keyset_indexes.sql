@@ -0,0 +1,4 @@
+-- Indexes matching the /song/get-global-songs keyset order, so every page is an index range scan
+-- no matter how deep the client has scrolled.
+create index if not exists song_created_at_id_idx on "Song" (created_at desc, id desc);
+create index if not exists songdata_created_at_title_artist_idx on "SongData" (created_at desc, title desc, artist desc);
@@ -0,0 +1,34 @@
+-- Canonical song identity (see app/song_key.py). Lookups and dedupe use song_key instead of raw title/artist.
+-- Existing rows are filled in by `python -m scripts.backfillSongKeys`; rows it can't key (a duplicate of an
+-- already keyed song) are left null and reported.
+alter table "SongData" add column if not exists song_key text;
+alter table "Song" add column if not exists song_key text;
+
+create unique index if not exists songdata_song_key_key on "SongData" (song_key);
+create unique index if not exists song_user_song_key_key on "Song" (id, song_key);
+
+-- rows: [{"title", "artist", "song_key", "lyrics", "hiragana_lyrics", "word_mapping", "payload", "payload_gzip", "payload_br", "payload_etag"}, ...]
+-- Rows are matched on song_key, or on title and artist for messages queued before song keys existed.
+create or replace function update_song_data_batch(rows jsonb)
+returns integer
+language sql
+as $$
+  with updated as (
+    update "SongData" as s
+    set lyrics = r.lyrics,
+        hiragana_lyrics = r.hiragana_lyrics,
+        word_mapping = r.word_mapping,
+        payload = r.payload,
+        payload_gzip = r.payload_gzip,
+        payload_br = r.payload_br,
+        payload_etag = r.payload_etag
+    from jsonb_to_recordset(rows) as r(
+      title text, artist text, song_key text, lyrics jsonb, hiragana_lyrics jsonb, word_mapping jsonb,
+      payload text, payload_gzip text, payload_br text, payload_etag text
+    )
+    where (r.song_key is not null and s.song_key = r.song_key)
+       or (r.song_key is null and s.title = r.title and s.artist = r.artist)
+    returning 1
+  )
+  select count(*)::integer from updated;
+$$;
@@ -0,0 +1,24 @@
+-- Fuzzy catalog search. search_text holds the normalized title and artist plus their hiragana and romaji
+-- readings (app/song_search.py); a trigram index over it serves partial and misspelled queries.
+-- Existing rows are filled in by `python -m scripts.backfillSearchText`.
+create extension if not exists pg_trgm;
+
+alter table "SongData" add column if not exists search_text text;
+
+create index if not exists songdata_search_text_trgm_idx on "SongData" using gin (search_text gin_trgm_ops);
+
+-- query is the normalized input, reading its hiragana form (or null). Songs are ranked by the best
+-- word similarity of either form to search_text; pg_trgm.word_similarity_threshold (0.6 by default)
+-- decides what counts as a match.
+create or replace function search_songs(query text, reading text default null, max_results integer default 20)
+returns table (title text, artist text, image_url text, score real)
+language sql
+stable
+as $$
+  select s.title, s.artist, s.image_url,
+         greatest(word_similarity(query, s.search_text), coalesce(word_similarity(reading, s.search_text), 0)) as score
+  from "SongData" as s
+  where query <% s.search_text or (reading is not null and reading <% s.search_text)
+  order by score desc, s.title
+  limit max_results;
+$$;
@@ -0,0 +1,49 @@
+-- What each processed song was built from, so rule and dictionary changes can requeue only the songs they
+-- affect (see longRunningFunction/reprocess.py) instead of the whole catalog.
+--   source_lyrics       the cleaned lyrics the worker processed, which is what gets requeued
+--   pipeline_version    longRunningFunction/pipeline_version.py: PIPELINE_REVISION plus a hash of the rule tables
+--   dictionary_version  the JMdict index version
+--   lemmas              every form the song's rules and dictionary lookups matched on (token surfaces and lemmas)
+--   idseqs              every JMdict entry its word mapping uses
+-- Rows processed before this migration have nulls and are treated as affected by every change.
+alter table "SongData" add column if not exists source_lyrics text;
+alter table "SongData" add column if not exists pipeline_version text;
+alter table "SongData" add column if not exists dictionary_version text;
+alter table "SongData" add column if not exists lemmas text[];
+alter table "SongData" add column if not exists idseqs integer[];
+
+create index if not exists songdata_lemmas_idx on "SongData" using gin (lemmas);
+create index if not exists songdata_idseqs_idx on "SongData" using gin (idseqs);
+
+-- rows: [{"title", "artist", "song_key", "lyrics", "hiragana_lyrics", "word_mapping", "payload", "payload_gzip", "payload_br", "payload_etag",
+--         "source_lyrics", "pipeline_version", "dictionary_version", "lemmas", "idseqs"}, ...]
+-- Rows are matched on song_key, or on title and artist for messages queued before song keys existed.
+create or replace function update_song_data_batch(rows jsonb)
+returns integer
+language sql
+as $$
+  with updated as (
+    update "SongData" as s
+    set lyrics = r.lyrics,
+        hiragana_lyrics = r.hiragana_lyrics,
+        word_mapping = r.word_mapping,
+        payload = r.payload,
+        payload_gzip = r.payload_gzip,
+        payload_br = r.payload_br,
+        payload_etag = r.payload_etag,
+        source_lyrics = coalesce(r.source_lyrics, s.source_lyrics),
+        pipeline_version = r.pipeline_version,
+        dictionary_version = r.dictionary_version,
+        lemmas = r.lemmas,
+        idseqs = r.idseqs
+    from jsonb_to_recordset(rows) as r(
+      title text, artist text, song_key text, lyrics jsonb, hiragana_lyrics jsonb, word_mapping jsonb,
+      payload text, payload_gzip text, payload_br text, payload_etag text,
+      source_lyrics text, pipeline_version text, dictionary_version text, lemmas text[], idseqs integer[]
+    )
+    where (r.song_key is not null and s.song_key = r.song_key)
+       or (r.song_key is null and s.title = r.title and s.artist = r.artist)
+    returning 1
+  )
+  select count(*)::integer from updated;
+$$;
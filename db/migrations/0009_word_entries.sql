@@ -0,0 +1,65 @@
+-- Word entries (dictionary data, furigana, romaji) stored once and shared between songs, instead of inside every
+-- SongData.word_mapping. id is a hash of the entry's content (lexicon/word_entries.py), so a row never changes.
+-- New songs store word_refs, word_mapping with every entry replaced by its id, and leave word_mapping null;
+-- older rows are converted by `python -m scripts.backfillWordRefs`.
+create table if not exists "WordEntry" (
+  id text primary key,
+  idseq integer,
+  entry jsonb not null,
+  created_at timestamptz not null default now()
+);
+
+create index if not exists wordentry_idseq_idx on "WordEntry" (idseq);
+
+-- entries are public dictionary content; the worker adds them with the same session it updates SongData with
+alter table "WordEntry" enable row level security;
+drop policy if exists "Word entries are readable" on "WordEntry";
+create policy "Word entries are readable" on "WordEntry" for select using (true);
+drop policy if exists "Word entries can be added" on "WordEntry";
+create policy "Word entries can be added" on "WordEntry" for insert to authenticated with check (true);
+
+alter table "SongData" add column if not exists word_refs jsonb;
+
+-- The plain payload is no longer written; get-song decompresses payload_gzip for clients that accept neither encoding.
+-- rows: [{"title", "artist", "song_key", "lyrics", "hiragana_lyrics", "word_refs", "payload_gzip", "payload_br", "payload_etag",
+--         "source_lyrics", "pipeline_version", "dictionary_version", "lemmas", "idseqs"}, ...]
+-- entries: [{"id", "idseq", "entry"}, ...], the WordEntry rows those songs reference (existing ones are skipped)
+-- Rows are matched on song_key, or on title and artist for messages queued before song keys existed.
+drop function if exists update_song_data_batch(jsonb);
+create or replace function update_song_data_batch(rows jsonb, entries jsonb default '[]'::jsonb)
+returns integer
+language sql
+as $$
+  with inserted as (
+    insert into "WordEntry" (id, idseq, entry)
+    select e.id, e.idseq, e.entry
+    from jsonb_to_recordset(entries) as e(id text, idseq integer, entry jsonb)
+    on conflict (id) do nothing
+    returning 1
+  ),
+  updated as (
+    update "SongData" as s
+    set lyrics = r.lyrics,
+        hiragana_lyrics = r.hiragana_lyrics,
+        word_mapping = r.word_mapping,
+        word_refs = r.word_refs,
+        payload = r.payload,
+        payload_gzip = r.payload_gzip,
+        payload_br = r.payload_br,
+        payload_etag = r.payload_etag,
+        source_lyrics = coalesce(r.source_lyrics, s.source_lyrics),
+        pipeline_version = r.pipeline_version,
+        dictionary_version = r.dictionary_version,
+        lemmas = r.lemmas,
+        idseqs = r.idseqs
+    from jsonb_to_recordset(rows) as r(
+      title text, artist text, song_key text, lyrics jsonb, hiragana_lyrics jsonb, word_mapping jsonb, word_refs jsonb,
+      payload text, payload_gzip text, payload_br text, payload_etag text,
+      source_lyrics text, pipeline_version text, dictionary_version text, lemmas text[], idseqs integer[]
+    )
+    where (r.song_key is not null and s.song_key = r.song_key)
+       or (r.song_key is null and s.title = r.title and s.artist = r.artist)
+    returning 1
+  )
+  select count(*)::integer from updated;
+$$;
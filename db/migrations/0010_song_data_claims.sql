@@ -0,0 +1,7 @@
+-- When an add-song request claimed its SongData placeholder row (see claim_song in app/routers/song.py).
+-- A placeholder whose ingest never finished (kanji_data and lyrics still null) is taken over by the next
+-- request once its claim is older than CLAIM_TIMEOUT_SECONDS, so a crashed or timed out request can't
+-- block the song forever. Placeholders left from before this migration have no claimed_at and can be
+-- taken over right away.
+alter table "SongData" add column if not exists claimed_at timestamptz;
+alter table "SongData" alter column claimed_at set default now();
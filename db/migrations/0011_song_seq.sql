@@ -0,0 +1,7 @@
+-- Row number for Song, used instead of id (the adding user's UUID) to break created_at ties in the
+-- /song/get-global-songs keyset, so page cursors don't expose user ids. Existing rows are numbered when
+-- the column is added.
+alter table "Song" add column if not exists seq bigint generated always as identity;
+
+create index if not exists song_created_at_seq_idx on "Song" (created_at desc, seq desc);
+drop index if exists song_created_at_id_idx;
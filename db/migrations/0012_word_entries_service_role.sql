@@ -0,0 +1,8 @@
+-- WordEntry ids are content hashes that clients can compute, and rows are never rewritten, so letting any
+-- authenticated user insert meant they could claim an id first with a poisoned entry. Only the service role
+-- (the worker and scripts.backfillWordRefs) adds entries now; it bypasses RLS, so no insert policy is needed.
+drop policy if exists "Word entries can be added" on "WordEntry";
+
+-- the worker's batch write, which also inserts entries, is callable by the service role only
+revoke execute on function update_song_data_batch(jsonb, jsonb) from public, anon, authenticated;
+grant execute on function update_song_data_batch(jsonb, jsonb) to service_role;
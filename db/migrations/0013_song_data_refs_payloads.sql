@@ -0,0 +1,9 @@
+-- Clears the stored get-song payloads. For a while the worker stored the /song/get-song-refs body (word_refs) in these
+-- columns, which get-song can't serve, and rows can't be told apart by their compressed bodies, so all of them go.
+-- Rebuild them straight after applying this, or every song falls back to building its body per request:
+--   python -m scripts.backfillPayloads
+update "SongData"
+set payload_gzip = null,
+    payload_br = null,
+    payload_etag = null
+where payload_etag is not null;
@@ -8,8 +8,29 @@ load_dotenv()
 
 api_url: str = os.getenv("SUPABASE_URL")
 key: str = os.getenv("SUPABASE_API")
+service_key: str = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
 
 def create_supabase_client():
     supabase: Client = create_client(api_url, key)
     return supabase
+
+
+# Auth calls (sign in, sign up, set_session) change the session of the client they run on, and every later query
+# on that client runs as that user. So they never go through a module level client shared between requests:
+# each request that needs them gets its own client from one of these.
+def create_user_client(access_token=None):
+    supabase = create_supabase_client()
+    if access_token:
+        # queries run as this user, without touching the client's auth session
+        supabase.postgrest.auth(access_token)
+    return supabase
+
+
+# A client with the service role key, which bypasses row level security, or None when the key isn't configured.
+# Only for writes no user may make (SqsOutbox, SongData), never for queries on a user's behalf.
+def create_service_client():
+    if not service_key:
+        return None
+    supabase: Client = create_client(api_url, service_key)
+    return supabase
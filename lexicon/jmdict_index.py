@@ -0,0 +1,198 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+from collections import defaultdict
+
+from lexicon.mapped_table import MappedTable, write_table
+
+'''
+Prebuilt, memory-mapped JMdict index.
+
+Jamdict(memory_mode=True) copies the whole SQLite dictionary into RAM on every cold start and then
+answers each lookup with a handful of SQL queries. Instead, the entries we actually use (forms, kana,
+senses, POS and priority tags) are extracted once at image build time into a mapped table keyed by
+surface form and by idseq:
+
+    python -m lexicon.jmdict_index
+
+Lookups match jamdict's exact (non-wildcard) search on kanji and kana forms, and return entries
+ordered by idseq like jamdict does. Gloss text is not indexed since we never look up English words.
+'''
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "jmdict.idx")
+
+FORM_PREFIX = b"f"
+IDSEQ_PREFIX = b"i"
+
+
+def default_index_path():
+    return os.getenv("JMDICT_INDEX_PATH", DEFAULT_INDEX_PATH)
+
+
+def form_key(text):
+    return FORM_PREFIX + text.encode("utf-8")
+
+
+def idseq_key(idseq):
+    # big endian so that byte order matches numeric order
+    return IDSEQ_PREFIX + struct.pack(">I", int(idseq))
+
+
+def _pack_idseqs(idseqs):
+    return struct.pack(f"<{len(idseqs)}I", *idseqs)
+
+
+def _unpack_idseqs(data):
+    return struct.unpack(f"<{len(data) // 4}I", data)
+
+
+def build_index(db_file=None, path=None):
+    """
+    Extract every JMdict entry from the jamdict SQLite database into a mapped table.
+
+    Args:
+        db_file: Path to jamdict.db (defaults to the jamdict-data copy jamdict itself uses)
+        path: Output path for the index
+
+    Returns:
+        The dictionary version string stored in the index
+    """
+    if db_file is None:
+        from jamdict import Jamdict
+        db_file = Jamdict().db_file
+    path = path or default_index_path()
+
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    # entry layout: [idseq, [[kanji, [pri]]], [[kana, [pri]]], [[[pos], [gloss]]]]
+    entries = {}
+    forms = defaultdict(set)
+    for (idseq,) in conn.execute("SELECT idseq FROM Entry ORDER BY idseq"):
+        entries[idseq] = [idseq, [], [], []]
+
+    kanji_by_id = {}
+    for kid, idseq, text in conn.execute("SELECT ID, idseq, text FROM Kanji ORDER BY ID"):
+        form = [text, []]
+        kanji_by_id[kid] = form
+        entries[idseq][1].append(form)
+        forms[text].add(idseq)
+    for kid, text in conn.execute("SELECT kid, text FROM KJP ORDER BY rowid"):
+        kanji_by_id[kid][1].append(text)
+
+    kana_by_id = {}
+    for kid, idseq, text in conn.execute("SELECT ID, idseq, text FROM Kana ORDER BY ID"):
+        form = [text, []]
+        kana_by_id[kid] = form
+        entries[idseq][2].append(form)
+        forms[text].add(idseq)
+    for kid, text in conn.execute("SELECT kid, text FROM KNP ORDER BY rowid"):
+        kana_by_id[kid][1].append(text)
+
+    sense_by_id = {}
+    for sid, idseq in conn.execute("SELECT ID, idseq FROM Sense ORDER BY ID"):
+        sense = [[], []]
+        sense_by_id[sid] = sense
+        entries[idseq][3].append(sense)
+    for sid, text in conn.execute("SELECT sid, text FROM pos ORDER BY rowid"):
+        sense_by_id[sid][0].append(text)
+    for sid, text in conn.execute("SELECT sid, text FROM SenseGloss ORDER BY rowid"):
+        sense_by_id[sid][1].append(text)
+
+    meta = dict(conn.execute("SELECT key, value FROM meta"))
+    conn.close()
+
+    items = {}
+    digest = hashlib.sha256()
+    for idseq, entry in entries.items():
+        value = json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        digest.update(value)
+        items[idseq_key(idseq)] = value
+    for text, idseqs in forms.items():
+        items[form_key(text)] = _pack_idseqs(sorted(idseqs))
+
+    version = f"jmdict-{meta.get('jmdict.version', 'unknown')}-{digest.hexdigest()[:12]}"
+    write_table(path, items, meta={
+        "dictionary_version": version,
+        "entries": len(entries),
+        "forms": len(forms),
+    })
+    return version
+
+
+def _decode_entry(data):
+    idseq, kanji, kana, senses = json.loads(data)
+    return {
+        "idseq": idseq,
+        "kanji": [{"text": text, "pri": pri} for text, pri in kanji],
+        "kana": [{"text": text, "pri": pri} for text, pri in kana],
+        "senses": [{"pos": pos, "gloss": gloss} for pos, gloss in senses],
+    }
+
+
+class JMdictIndex:
+    def __init__(self, path=None):
+        path = path or default_index_path()
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"JMdict index not found at {path}. Build it with `python -m lexicon.jmdict_index`.")
+        self.table = MappedTable(path)
+        self.version = self.table.meta["dictionary_version"]
+
+    def get(self, idseq):
+        # returns a single entry by idseq, or None
+        data = self.table.get(idseq_key(idseq))
+        if data is None:
+            return None
+        return _decode_entry(data)
+
+    def entries(self):
+        # iterates over every entry in idseq order
+        for _, data in self.table.items(IDSEQ_PREFIX):
+            yield _decode_entry(data)
+
+    def lookup(self, form):
+        # returns every entry with a kanji or kana form exactly equal to `form`, ordered by idseq
+        data = self.table.get(form_key(form))
+        if data is None:
+            return []
+        return [self.get(idseq) for idseq in _unpack_idseqs(data)]
+
+    def changed_since(self, old):
+        """
+        Differences from an older index.
+
+        Args:
+            old: JMdictIndex built from an earlier jamdict-data
+
+        Returns:
+            (idseqs of entries added, removed or changed, forms whose lookup results may have changed)
+        """
+        idseqs = {struct.unpack(">I", key[1:])[0] for key in self.table.changed_keys(old.table, IDSEQ_PREFIX)}
+        forms = {key[1:].decode("utf-8") for key in self.table.changed_keys(old.table, FORM_PREFIX)}
+        # a changed entry can also reorder the results for its forms (e.g. a new priority tag), so those count too
+        for idseq in idseqs:
+            for entry in (self.get(idseq), old.get(idseq)):
+                if entry is not None:
+                    forms.update(form["text"] for form in entry["kanji"] + entry["kana"])
+        return idseqs, forms
+
+
+_index = None
+
+
+def get_index():
+    # the index is opened on first use and shared for the life of the process
+    global _index
+    if _index is None:
+        _index = JMdictIndex()
+    return _index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped JMdict index.")
+    parser.add_argument("--db", help="path to jamdict.db (defaults to jamdict-data)")
+    parser.add_argument("--out", help="output path for the index")
+    args = parser.parse_args()
+    version = build_index(args.db, args.out)
+    print(f"Built JMdict index {version} at {args.out or default_index_path()}")
@@ -0,0 +1,102 @@
+import argparse
+import hashlib
+import json
+import os
+
+from lexicon.mapped_table import MappedTable, write_table
+
+'''
+Prebuilt, memory-mapped kanji table.
+
+Merges kanji.json (JLPT level, meanings and readings) with the KRADFILE radical decomposition that
+ships with jamdict, so the API never parses kanji.json or opens jamdict at runtime:
+
+    python -m lexicon.kanji_table --kanji kanji.json
+
+Only kanji present in kanji.json are stored, since those are the only ones the API returns data for.
+'''
+
+DEFAULT_TABLE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "kanji.idx")
+DEFAULT_KANJI_JSON = "kanji.json"
+
+
+def default_table_path():
+    return os.getenv("KANJI_TABLE_PATH", DEFAULT_TABLE_PATH)
+
+
+def build_table(kanji_json=None, path=None):
+    """
+    Build the kanji table from kanji.json and KRADFILE.
+
+    Args:
+        kanji_json: Path to kanji.json
+        path: Output path for the table
+
+    Returns:
+        The table version string stored in the table
+    """
+    from jamdict.krad import KRad
+    path = path or default_table_path()
+    with open(kanji_json or DEFAULT_KANJI_JSON, "r", encoding="utf-8") as file:
+        kanji_data = json.load(file)
+    krad = KRad().krad
+
+    # value layout: [jlpt_new, [meanings], [readings_on], [readings_kun], [radicals]]
+    items = {}
+    digest = hashlib.sha256()
+    for kanji in sorted(kanji_data):
+        data = kanji_data[kanji]
+        value = json.dumps(
+            [data["jlpt_new"], data["meanings"], data["readings_on"], data["readings_kun"], krad.get(kanji, [])],
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        digest.update(kanji.encode("utf-8") + value)
+        items[kanji.encode("utf-8")] = value
+
+    version = f"kanji-{digest.hexdigest()[:12]}"
+    write_table(path, items, meta={"kanji_version": version, "kanji": len(items)})
+    return version
+
+
+class KanjiTable:
+    def __init__(self, path=None):
+        path = path or default_table_path()
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Kanji table not found at {path}. Build it with `python -m lexicon.kanji_table`.")
+        self.table = MappedTable(path)
+        self.version = self.table.meta["kanji_version"]
+
+    def get(self, kanji):
+        # returns the data for a single kanji in the API's response shape, or None
+        data = self.table.get(kanji.encode("utf-8"))
+        if data is None:
+            return None
+        jlpt_new, meanings, readings_on, readings_kun, radicals = json.loads(data)
+        return {
+            "jlpt_new": jlpt_new,
+            "meanings": meanings,
+            "readings_on": readings_on,
+            "readings_kun": readings_kun,
+            "radicals": radicals,
+        }
+
+
+_table = None
+
+
+def get_kanji_table():
+    # the table is opened on first use and shared for the life of the process
+    global _table
+    if _table is None:
+        _table = KanjiTable()
+    return _table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped kanji table.")
+    parser.add_argument("--kanji", help="path to kanji.json (defaults to ./kanji.json)")
+    parser.add_argument("--out", help="output path for the table")
+    args = parser.parse_args()
+    version = build_table(args.kanji, args.out)
+    print(f"Built kanji table {version} at {args.out or default_table_path()}")
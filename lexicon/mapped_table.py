@@ -0,0 +1,127 @@
+import json
+import mmap
+import struct
+
+'''
+A read-only key/value table stored in a single file and accessed through mmap.
+Nothing is parsed at open time beyond the header, so opening the table is constant time
+and only the pages that are actually looked up ever get loaded into memory.
+
+Layout:
+    header   magic, format version, entry count, meta length
+    meta     JSON object (versions, build info)
+    index    one (key offset, key length, value offset, value length) row per key, sorted by key bytes
+    blob     key and value bytes
+'''
+
+MAGIC = b"GKMT"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHHII")
+INDEX_ROW = struct.Struct("<IIII")
+
+
+def write_table(path, items, meta=None):
+    """
+    Write a mapping of bytes keys to bytes values as a mapped table.
+
+    Args:
+        path: Destination file path
+        items: Dict (or iterable of pairs) of bytes key -> bytes value
+        meta: Optional JSON-serializable dict stored in the header
+
+    Returns:
+        Number of keys written
+    """
+    if isinstance(items, dict):
+        items = items.items()
+    rows = sorted(items)
+    meta_bytes = json.dumps(meta or {}, ensure_ascii=False).encode("utf-8")
+
+    blob_start = HEADER.size + len(meta_bytes) + INDEX_ROW.size * len(rows)
+    index = bytearray()
+    blob = bytearray()
+    for key, value in rows:
+        key_offset = blob_start + len(blob)
+        blob += key
+        value_offset = blob_start + len(blob)
+        blob += value
+        index += INDEX_ROW.pack(key_offset, len(key), value_offset, len(value))
+    if blob_start + len(blob) > 0xFFFFFFFF:
+        raise ValueError("Mapped table is too large for 32 bit offsets.")
+
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(rows), len(meta_bytes)))
+        file.write(meta_bytes)
+        file.write(index)
+        file.write(blob)
+    return len(rows)
+
+
+class MappedTable:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, count, meta_len = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a mapped table (or was built by an incompatible version).")
+        self.count = count
+        self.meta = json.loads(self._mm[HEADER.size:HEADER.size + meta_len])
+        self._index_start = HEADER.size + meta_len
+
+    def __len__(self):
+        return self.count
+
+    def _row(self, i):
+        return INDEX_ROW.unpack_from(self._mm, self._index_start + i * INDEX_ROW.size)
+
+    def get(self, key):
+        # binary search over the sorted index; keys are compared as raw bytes
+        lo, hi = 0, self.count
+        mm = self._mm
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key_offset, key_len, value_offset, value_len = self._row(mid)
+            current = mm[key_offset:key_offset + key_len]
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return mm[value_offset:value_offset + value_len]
+        return None
+
+    def items(self, prefix=b""):
+        # yields (key, value) pairs in key order, optionally restricted to keys starting with prefix
+        mm = self._mm
+        for i in range(self.count):
+            key_offset, key_len, value_offset, value_len = self._row(i)
+            key = mm[key_offset:key_offset + key_len]
+            if key.startswith(prefix):
+                yield key, mm[value_offset:value_offset + value_len]
+
+    def changed_keys(self, other, prefix=b""):
+        # yields keys (in key order) that are only in one of the two tables or have different values, walking both in step
+        mine, theirs = self.items(prefix), other.items(prefix)
+        a, b = next(mine, None), next(theirs, None)
+        while a is not None or b is not None:
+            if b is None or (a is not None and a[0] < b[0]):
+                yield a[0]
+                a = next(mine, None)
+            elif a is None or b[0] < a[0]:
+                yield b[0]
+                b = next(theirs, None)
+            else:
+                if a[1] != b[1]:
+                    yield a[0]
+                a, b = next(mine, None), next(theirs, None)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
@@ -0,0 +1,130 @@
+import argparse
+import re
+import sys
+
+'''
+Table-driven Hepburn romaji for kana.
+
+pykakasi segments its input by script, converts katakana to hiragana and then matches the longest
+hiragana sequence in its Hepburn dictionary. For input that is a single run of hiragana or katakana
+(with long vowel marks), kana_to_hepburn() gives the same romaji from the table below without
+pykakasi's per-call setup; it returns None for anything else (kanji, mixed scripts, punctuation), which
+callers convert with kakasi.convert(text)[0]["hepburn"] as before. The table mirrors pykakasi 2.3's
+quirks on purpose (てぃ -> "tei", っ alone -> "tsu", ん before a vowel -> "n'a"), so
+
+    python -m lexicon.romaji --check
+
+compares both on every JMdict kana form and exits non-zero on the first mismatches.
+'''
+
+HEPBURN = {
+    # kana
+    "ぁ": "a", "あ": "a", "ば": "ba", "べ": "be", "び": "bi", "ぼ": "bo", "ぶ": "bu", "ち": "chi", "だ": "da",
+    "で": "de", "ど": "do", "ぇ": "e", "え": "e", "ゑ": "e", "ふ": "fu", "が": "ga", "げ": "ge", "ぎ": "gi", "ご": "go",
+    "ぐ": "gu", "は": "ha", "へ": "he", "ひ": "hi", "ほ": "ho", "ぃ": "i", "い": "i", "ゐ": "i", "じ": "ji", "ぢ": "ji",
+    "か": "ka", "ゕ": "ka", "け": "ke", "ゖ": "ke", "き": "ki", "こ": "ko", "く": "ku", "ま": "ma", "め": "me",
+    "み": "mi", "も": "mo", "む": "mu", "ん": "n", "な": "na", "ね": "ne", "に": "ni", "の": "no", "ぬ": "nu",
+    "ぉ": "o", "お": "o", "ぱ": "pa", "ぺ": "pe", "ぴ": "pi", "ぽ": "po", "ぷ": "pu", "ら": "ra", "れ": "re",
+    "り": "ri", "ろ": "ro", "る": "ru", "さ": "sa", "せ": "se", "し": "shi", "そ": "so", "す": "su", "た": "ta",
+    "て": "te", "と": "to", "っ": "tsu", "つ": "tsu", "ぅ": "u", "う": "u", "ゔ": "vu", "ゎ": "wa", "わ": "wa",
+    "を": "wo", "ゃ": "ya", "や": "ya", "ょ": "yo", "よ": "yo", "ゅ": "yu", "ゆ": "yu", "ざ": "za", "ぜ": "ze",
+    "ぞ": "zo", "ず": "zu", "づ": "zu",
+    # yōon and other digraphs, and ん before a vowel
+    "びゃ": "bya", "びょ": "byo", "びゅ": "byu", "ちゃ": "cha", "ちぇ": "che", "ちょ": "cho", "ちゅ": "chu", "でぃ": "di",
+    "ふぁ": "fa", "ふぇ": "fe", "ふぃ": "fi", "ふぉ": "fo", "ぎゃ": "gya", "ぎょ": "gyo", "ぎゅ": "gyu", "ひゃ": "hya",
+    "ひょ": "hyo", "ひゅ": "hyu", "じゃ": "ja", "ぢゃ": "ja", "じょ": "jo", "ぢょ": "jo", "じゅ": "ju", "ぢゅ": "ju",
+    "きゃ": "kya", "きょ": "kyo", "きゅ": "kyu", "みゃ": "mya", "みょ": "myo", "みゅ": "myu", "んあ": "n'a", "んえ": "n'e",
+    "んい": "n'i", "んお": "n'o", "んう": "n'u", "にゃ": "nya", "にょ": "nyo", "にゅ": "nyu", "ぴゃ": "pya", "ぴょ": "pyo",
+    "ぴゅ": "pyu", "りゃ": "rya", "りょ": "ryo", "りゅ": "ryu", "しゃ": "sha", "しょ": "sho", "しゅ": "shu", "ゔぁ": "va",
+    "ゔぇ": "ve", "ゔぃ": "vi", "ゔぉ": "vo",
+    # っ doubles the following consonant
+    "っば": "bba", "っべ": "bbe", "っび": "bbi", "っぼ": "bbo", "っぶ": "bbu", "っびゃ": "bbya", "っびょ": "bbyo",
+    "っびゅ": "bbyu", "っだ": "dda", "っで": "dde", "っど": "ddo", "っふぁ": "ffa", "っふぇ": "ffe", "っふぃ": "ffi",
+    "っふぉ": "ffo", "っふ": "ffu", "っが": "gga", "っげ": "gge", "っぎ": "ggi", "っご": "ggo", "っぐ": "ggu", "っぎゃ": "ggya",
+    "っぎょ": "ggyo", "っぎゅ": "ggyu", "っは": "hha", "っへ": "hhe", "っひ": "hhi", "っほ": "hho", "っひゃ": "hhya",
+    "っひょ": "hhyo", "っひゅ": "hhyu", "っじゃ": "jja", "っじ": "jji", "っぢ": "jji", "っじょ": "jjo", "っじゅ": "jju",
+    "っぢゃ": "jjya", "っぢょ": "jjyo", "っぢゅ": "jjyu", "っか": "kka", "っけ": "kke", "っき": "kki", "っこ": "kko",
+    "っく": "kku", "っきゃ": "kkya", "っきょ": "kkyo", "っきゅ": "kkyu", "っぱ": "ppa", "っぺ": "ppe", "っぴ": "ppi",
+    "っぽ": "ppo", "っぷ": "ppu", "っぴゃ": "ppya", "っぴょ": "ppyo", "っぴゅ": "ppyu", "っら": "rra", "っれ": "rre",
+    "っり": "rri", "っろ": "rro", "っる": "rru", "っりゃ": "rrya", "っりょ": "rryo", "っりゅ": "rryu", "っさ": "ssa",
+    "っせ": "sse", "っしゃ": "ssha", "っし": "sshi", "っしょ": "ssho", "っしゅ": "sshu", "っそ": "sso", "っす": "ssu",
+    "っちゃ": "tcha", "っち": "tchi", "っちょ": "tcho", "っちゅ": "tchu", "った": "tta", "って": "tte", "っと": "tto",
+    "っつ": "ttsu", "っゔぁ": "vva", "っゔぇ": "vve", "っゔぃ": "vvi", "っゔぉ": "vvo", "っゔ": "vvu", "っや": "yya",
+    "っよ": "yyo", "っゆ": "yyu", "っざ": "zza", "っぞ": "zzo", "っず": "zzu", "っづ": "zzu",
+}
+MAX_KEY_LENGTH = 3
+# repeat the last romaji character, like pykakasi (which also splits segments at a half-width ｰ, so that falls back)
+LONG_VOWEL_MARKS = "\u30fc\u2015\u2212"
+# one pykakasi segment: hiragana or katakana (ぁ-ゖ, ァ-ヶ) with long vowel marks anywhere but first
+KANA_RUN = re.compile(f"[\u3041-\u3096][\u3041-\u3096{LONG_VOWEL_MARKS}]*|[\u30a1-\u30f6][\u30a1-\u30f6{LONG_VOWEL_MARKS}]*")
+KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30a1, 0x30f7)}
+# kana that start a longer key; every other kana is a single lookup
+DIGRAPH_STARTS = {key[0] for key in HEPBURN if len(key) > 1}
+
+
+def kana_to_hepburn(text):
+    """
+    Args:
+        text: Text to romanize
+
+    Returns:
+        The Hepburn romaji pykakasi gives for text when text is all hiragana or all katakana, otherwise None
+    """
+    if text == "":
+        return ""
+    if KANA_RUN.fullmatch(text) is None:
+        return None
+    hiragana = text.translate(KATAKANA_TO_HIRAGANA)
+    romaji = []
+    i = 0
+    while i < len(hiragana):
+        char = hiragana[i]
+        if char in LONG_VOWEL_MARKS:
+            romaji.append(romaji[-1][-1])
+            i += 1
+            continue
+        if char not in DIGRAPH_STARTS:
+            romaji.append(HEPBURN[char])
+            i += 1
+            continue
+        for length in range(min(MAX_KEY_LENGTH, len(hiragana) - i), 0, -1):
+            match = HEPBURN.get(hiragana[i:i + length])
+            if match is not None:
+                romaji.append(match)
+                i += length
+                break
+    return "".join(romaji)
+
+
+def check(index):
+    # kana forms of every entry (and kanji forms written in kana) where the table and pykakasi disagree
+    import pykakasi
+    kakasi = pykakasi.kakasi()
+    checked = 0
+    mismatches = []
+    for entry in index.entries():
+        for form in entry["kana"] + entry["kanji"]:
+            romaji = kana_to_hepburn(form["text"])
+            if romaji is None:
+                continue
+            checked += 1
+            expected = kakasi.convert(form["text"])[0]["hepburn"]
+            if romaji != expected:
+                mismatches.append((form["text"], romaji, expected))
+    return checked, mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kana to Hepburn romaji.")
+    parser.add_argument("--check", action="store_true", help="compare with pykakasi on every JMdict kana form")
+    parser.add_argument("text", nargs="*")
+    args = parser.parse_args()
+    if args.check:
+        from lexicon.jmdict_index import JMdictIndex
+        checked, mismatches = check(JMdictIndex())
+        for text, romaji, expected in mismatches[:20]:
+            print(f"{text}: {romaji} (pykakasi: {expected})")
+        print(f"{checked} kana forms checked, {len(mismatches)} mismatches")
+        sys.exit(1 if mismatches else 0)
+    for text in args.text:
+        print(kana_to_hepburn(text))
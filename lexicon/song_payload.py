@@ -0,0 +1,45 @@
+import base64
+import gzip
+import hashlib
+import json
+
+# brotli is optional; without it only the gzip payload is stored
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+'''
+The /song/get-song body as SongData stores it: precompressed copies plus an ETag, so the API sends processed
+songs without building or compressing anything.
+
+The body is the rehydrated shape clients already read (word_mapping, not word_refs). word_refs keeps the
+uncompressed copy of each entry in WordEntry; the compressed payloads still repeat them, which is the price of
+serving get-song from one column. The worker builds payloads as it writes songs, and scripts.backfillPayloads
+builds them for rows stored without one.
+
+    song.update(build_payload(song, kanji_data))
+'''
+
+
+def build_payload(song, kanji_data):
+    """
+    Args:
+        song: Dict with the song's lyrics, hiragana_lyrics and (rehydrated) word_mapping
+        kanji_data: The song's kanji_data, written by the API
+
+    Returns:
+        {"payload_gzip", "payload_br", "payload_etag"} for the SongData row. The body is serialized the way FastAPI's
+        JSONResponse does; payload_br is None without brotli.
+    """
+    body = json.dumps({
+        "lyrics": song["lyrics"],
+        "hiragana_lyrics": song["hiragana_lyrics"],
+        "word_mapping": song["word_mapping"],
+        "kanji_data": kanji_data
+    }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return {
+        "payload_gzip": base64.b64encode(gzip.compress(body, compresslevel=9, mtime=0)).decode("ascii"),
+        "payload_br": base64.b64encode(brotli.compress(body, quality=11)).decode("ascii") if brotli else None,
+        "payload_etag": f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+    }
@@ -0,0 +1,82 @@
+import hashlib
+import json
+
+'''
+Shared, content-addressed store for word_mapping entries.
+
+A song's word_mapping repeats full dictionary entries (definitions, furigana, romaji) for every word, and the
+same entries show up in thousands of songs. Instead, each entry is stored once in the "WordEntry" table under
+a hash of its content, and songs keep word_refs: the same shape as word_mapping with every entry replaced by
+its id. Suffix data stays inline since it is specific to the song's surface form.
+
+    word_refs, entries = split_word_mapping(word_mapping)
+    word_mapping == rehydrate(word_refs, entries)
+
+The worker writes both (see update_song_data_batch); the API rehydrates through an in-process cache, which
+never goes stale since an id always names the same content.
+'''
+
+
+def entry_id(entry):
+    # a hash of the entry's canonical JSON; equal entries from different songs get the same id
+    encoded = json.dumps(entry, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:32]
+
+
+def _ref_list(entries, found):
+    if entries is None:
+        return None
+    ids = []
+    for entry in entries:
+        id = entry_id(entry)
+        found.setdefault(id, entry)
+        ids.append(id)
+    return ids
+
+
+def split_word_mapping(word_mapping):
+    """
+    Args:
+        word_mapping: A song's word_mapping
+
+    Returns:
+        (word_refs, {id: entry} for every entry it references)
+    """
+    word_refs = {}
+    entries = {}
+    for word, data in word_mapping.items():
+        if isinstance(data, list):
+            # known suffixes are stored as a bare entry list rather than root/suffixes/composite
+            word_refs[word] = _ref_list(data, entries)
+        else:
+            word_refs[word] = {
+                "root": _ref_list(data["root"], entries),
+                "suffixes": data["suffixes"],
+                "composite": _ref_list(data["composite"], entries),
+            }
+    return word_refs, entries
+
+
+def referenced_ids(word_refs):
+    ids = set()
+    for refs in word_refs.values():
+        if isinstance(refs, list):
+            ids.update(refs)
+        else:
+            ids.update(refs["root"] or ())
+            ids.update(refs["composite"])
+    return ids
+
+
+def rehydrate(word_refs, entries):
+    # the word_mapping that word_refs was split from, given every entry it references
+    def resolve(ids):
+        return None if ids is None else [entries[id] for id in ids]
+
+    word_mapping = {}
+    for word, refs in word_refs.items():
+        if isinstance(refs, list):
+            word_mapping[word] = resolve(refs)
+        else:
+            word_mapping[word] = {"root": resolve(refs["root"]), "suffixes": refs["suffixes"], "composite": resolve(refs["composite"])}
+    return word_mapping
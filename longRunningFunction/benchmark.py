@@ -0,0 +1,189 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+'''
+Per-stage benchmark for the lyric processing pipeline.
+
+Runs split_into_lines, dakuten_check, tokenize, process_tokenized_lines and convert_to_hiragana over a
+fixed corpus and prints one JSON report: wall time per stage (median over --repeat runs), dictionary
+lookups per second, peak traced memory per stage, and a hash of the pipeline output so two runs can be
+checked for equivalence. The corpus starts with the song kept in the comments at the bottom of main.py;
+more lyrics files can be added with --corpus.
+
+word_mapping.json (at the repository root) is used as a golden file: every word it shares with the
+benchmark output must map to the same data.
+
+    python benchmark.py --repeat 5 --out before.json
+    python benchmark.py --repeat 5 --compare before.json
+'''
+
+WORKER_DIR = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_GOLDEN = os.path.join(WORKER_DIR, "..", "word_mapping.json")
+STAGES = ["split_into_lines", "dakuten_check", "tokenize", "process_tokenized_lines", "convert_to_hiragana"]
+EMBEDDED_SONG = re.compile(r'^# cleaned_lyrics = """(.*?)^# """', re.MULTILINE | re.DOTALL)
+
+
+def embedded_song():
+    # the first song kept in the comments at the bottom of main.py
+    with open(os.path.join(WORKER_DIR, "main.py"), "r", encoding="utf-8") as file:
+        match = EMBEDDED_SONG.search(file.read())
+    lines = match.group(1).split("\n")
+    return "\n".join(line[2:] if line.startswith("# ") else line.lstrip("#") for line in lines)
+
+
+def load_corpus(paths):
+    corpus = [("main.py", embedded_song())]
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as file:
+            corpus.append((os.path.basename(path), file.read()))
+    return corpus
+
+
+def run_pipeline(main, lyrics, timings):
+    # one pass over every stage, adding each stage's wall time to `timings`
+    values = lyrics
+    for stage in STAGES:
+        start = time.perf_counter()
+        values = getattr(main, stage)(values)
+        timings[stage] += time.perf_counter() - start
+        if stage == "process_tokenized_lines":
+            word_mapping, values = values
+            processed_lines = values
+    return word_mapping, processed_lines, values
+
+
+def stage_peaks(main, lyrics):
+    # peak traced allocation per stage, measured in a separate pass since tracing slows everything down
+    peaks = {}
+    values = lyrics
+    tracemalloc.start()
+    for stage in STAGES:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        values = getattr(main, stage)(values)
+        peaks[stage] = tracemalloc.get_traced_memory()[1] - before
+        if stage == "process_tokenized_lines":
+            values = values[1]
+    tracemalloc.stop()
+    return peaks
+
+
+def check_golden(word_mapping, golden_path):
+    if not os.path.exists(golden_path):
+        return None
+    with open(golden_path, "r", encoding="utf-8") as file:
+        golden = json.load(file)
+    overlap = [word for word in golden if word in word_mapping]
+    mismatches = [word for word in overlap if golden[word] != word_mapping[word]]
+    return {"golden_words": len(golden), "overlap": len(overlap), "mismatches": mismatches}
+
+
+def benchmark(main, corpus, repeat, cold):
+    lookups = 0
+    original_get_word_info = main.get_word_info
+
+    def counted_get_word_info(*args, **kwargs):
+        nonlocal lookups
+        lookups += 1
+        return original_get_word_info(*args, **kwargs)
+
+    main.get_word_info = counted_get_word_info
+    runs = []
+    outputs = []
+    try:
+        for _ in range(repeat):
+            if cold:
+                reset_word_cache(main)
+            timings = dict.fromkeys(STAGES, 0.0)
+            lookups = 0
+            outputs = [run_pipeline(main, lyrics, timings) for _, lyrics in corpus]
+            runs.append((timings, lookups))
+    finally:
+        main.get_word_info = original_get_word_info
+
+    peaks = dict.fromkeys(STAGES, 0)
+    for _, lyrics in corpus:
+        for stage, peak in stage_peaks(main, lyrics).items():
+            peaks[stage] = max(peaks[stage], peak)
+
+    stages = {}
+    for stage in STAGES:
+        times = [timings[stage] for timings, _ in runs]
+        stages[stage] = {
+            "median_ms": round(statistics.median(times) * 1000, 3),
+            "min_ms": round(min(times) * 1000, 3),
+            "peak_traced_kb": round(peaks[stage] / 1024, 1),
+        }
+    lookup_times = [timings["process_tokenized_lines"] for timings, _ in runs]
+    lookup_count = runs[-1][1]
+    stages["process_tokenized_lines"]["lookups"] = lookup_count
+    stages["process_tokenized_lines"]["lookups_per_second"] = round(lookup_count / statistics.median(lookup_times), 1)
+
+    merged_mapping = {}
+    for word_mapping, _, _ in outputs:
+        for word, data in word_mapping.items():
+            merged_mapping.setdefault(word, data)
+    digest = hashlib.sha256(json.dumps(
+        [[word_mapping, lyrics, hiragana] for word_mapping, lyrics, hiragana in outputs],
+        ensure_ascii=False, sort_keys=True,
+    ).encode("utf-8")).hexdigest()
+    return {
+        "corpus": [{"name": name, "lines": len(main.split_into_lines(lyrics))} for name, lyrics in corpus],
+        "repeat": repeat,
+        "cold_cache": cold,
+        "stages": stages,
+        "total_median_ms": round(sum(stage["median_ms"] for stage in stages.values()), 3),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "dictionary_version": main.jmdict.version,
+        "output_sha256": digest,
+    }, merged_mapping
+
+
+def reset_word_cache(main):
+    # a fresh, empty cache so every lookup goes to the dictionary, and empty kana/romaji memos
+    cache_dir = tempfile.mkdtemp(prefix="word_cache_")
+    main.word_cache = main.WordCache(main.jmdict.version, path=os.path.join(cache_dir, "cache.sqlite"), seed_path=os.path.join(cache_dir, "none"))
+    main.to_furigana.cache_clear()
+    main.to_romaji.cache_clear()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the lyric processing pipeline.")
+    parser.add_argument("--corpus", nargs="*", default=[], help="extra lyrics files to add to the corpus")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per stage")
+    parser.add_argument("--cold", action="store_true", help="start every run with empty word and conversion caches")
+    parser.add_argument("--golden", default=DEFAULT_GOLDEN, help="word_mapping golden file")
+    parser.add_argument("--out", help="also write the report to this file")
+    parser.add_argument("--compare", help="previous report; fail if the pipeline output differs from it")
+    args = parser.parse_args()
+
+    import main
+    report, word_mapping = benchmark(main, load_corpus(args.corpus), args.repeat, args.cold)
+    report["golden"] = check_golden(word_mapping, args.golden)
+
+    failures = []
+    if report["golden"] and report["golden"]["mismatches"]:
+        failures.append(f"{len(report['golden']['mismatches'])} words differ from {args.golden}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            previous = json.load(file)
+        report["compared_to"] = {name: previous[name] for name in ("output_sha256", "total_median_ms")}
+        if previous["output_sha256"] != report["output_sha256"]:
+            failures.append(f"output differs from {args.compare}")
+    report["failures"] = failures
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    sys.exit(1 if failures else 0)
@@ -1,4 +1,8 @@
-from jamdict import Jamdict
+from lexicon.jmdict_index import JMdictIndex, get_index
+from lexicon.word_entries import split_word_mapping
+from lexicon.romaji import kana_to_hepburn
+from lexicon.song_payload import build_payload
+from word_cache import WordCache
 import json
 import pykakasi
 import os
@@ -6,7 +10,11 @@ from supabase import Client, create_client
 from dotenv import load_dotenv
 import fugashi
 import re
-from copy import deepcopy
+from functools import lru_cache
+from collections import namedtuple
+from pool import ProcessPool, WorkerError
+from pipeline_version import RULE_TABLES, pipeline_version
+import time
 
 #TODO: ensure these meanings are accurate.
 AUXILIARIES = {
@@ -131,6 +139,19 @@ SUFFIX_DICT = {
 
 ADDITIONAL_SUFFIXES = ['さ', 'って']
 
+# bump whenever the processing code changes in a way that changes its output; the rule tables are hashed in on their own
+PIPELINE_REVISION = 1
+
+# number of processes songs are spread across; 1 processes everything inline
+POOL_SIZE = int(os.getenv("WORKER_PROCESSES", os.cpu_count() or 1))
+# when a batch holds a single song at least this many lines long, its lines are split across the pool instead (0 disables)
+POOL_SPLIT_LINES = int(os.getenv("WORKER_SPLIT_LINES", "0"))
+# processing stops this long before the Lambda times out, leaving time to write the finished songs and report the rest as failed
+WRITE_RESERVE_SECONDS = float(os.getenv("WRITE_RESERVE_SECONDS", "15"))
+
+# a tokenized word. fugashi nodes read surface/features lazily from the tagger's buffers, so they are copied out eagerly
+Token = namedtuple("Token", ["surface", "feature", "pos"])
+
 # Mapping of basic hiragana/katakana to their dakuten and handakuten equivalents
 DAKUTEN_MAP = {
     # Dakuten cases (濁点)
@@ -150,23 +171,70 @@ HANDAKUTEN_MAP = {
     'ハ': 'パ', 'ヒ': 'ピ', 'フ': 'プ', 'ヘ': 'ペ', 'ホ': 'ポ'
 }
 
+PIPELINE_VERSION = pipeline_version(PIPELINE_REVISION, {name: globals()[name] for name in RULE_TABLES})
+
 load_dotenv()
 
 api_url: str = os.getenv("SUPABASE_URL")
-key: str = os.getenv("SUPABASE_API")
+# the worker writes with the service role key: requeued messages (reprocess.py) carry no user session, and RLS hides
+# SongData from a client without one, so writes would match nothing
+key: str = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
 def create_supabase_client():
     # print("Creating Supabase client.")
     supabase: Client = create_client(api_url, key)
     return supabase
 
-jam = Jamdict(memory_mode=True)
-kakasi = pykakasi.kakasi()
-kakasi.setMode("J", "H")
-kakasi.setMode("K", "H")
-conv = kakasi.getConverter()
-supabase = create_supabase_client()
+def create_kakasi():
+    kakasi = pykakasi.kakasi()
+    kakasi.setMode("J", "H")
+    kakasi.setMode("K", "H")
+    return kakasi, kakasi.getConverter()
+
+jmdict = get_index()
+word_cache = WordCache(jmdict.version)
+kakasi, conv = create_kakasi()
+supabase = None
 tagger = fugashi.Tagger()
+pool = None
+# WordEntry ids this process has already written; they aren't sent again while the Lambda stays warm
+stored_entry_ids = set()
+MAX_STORED_ENTRY_IDS = 100000
+
+# Kana and romaji conversions, memoized for the life of the process: the same surfaces, lemmas and auxiliaries
+# come up again and again across lines, entries and songs. Both are pure functions of their input.
+@lru_cache(maxsize=65536)
+def to_furigana(text):
+    return conv.do(text)
+
+@lru_cache(maxsize=65536)
+def to_romaji(text):
+    # romaji of the first segment, as the pipeline has always used it; kana (most calls) skips pykakasi
+    romaji = kana_to_hepburn(text)
+    if romaji is None:
+        romaji = kakasi.convert(text)[0]["hepburn"]
+    return romaji
+
+# called in each forked pool process so it holds its own tagger, converter, dictionary handle and cache connection
+def init_worker_process():
+    global jmdict, word_cache, kakasi, conv, tagger
+    jmdict = JMdictIndex()
+    word_cache = WordCache(jmdict.version)
+    kakasi, conv = create_kakasi()
+    tagger = fugashi.Tagger()
+
+def get_pool():
+    global pool
+    if pool is None:
+        pool = ProcessPool(POOL_SIZE, init_worker_process)
+    return pool
+
+# the client is created on first use so the pipeline can be imported without credentials (e.g. at image build time)
+def get_supabase():
+    global supabase
+    if supabase is None:
+        supabase = create_supabase_client()
+    return supabase
 
 def split_into_lines(lyrics):
     # print("Splitting lyrics into lines.")
@@ -242,16 +310,16 @@ def has_standalone_diacritics(text: str) -> bool:
 
 
 '''
-There is a race condition occurring in this code. I believe the tagger is not thread safe. However, the only way I know at the moment is to use the print.
+fugashi nodes read their surface and features lazily out of the tagger's lattice, which is reused by the
+next call. Keeping nodes around across lines meant earlier lines could be corrupted by later parses (the old
+print calls hid this by forcing every field to load). Tokens are copied out eagerly instead, so the tagger
+can be called again safely.
 '''
 def tokenize(lines):
     # print("Tokenizing lyrics.")
     line_list = []
     for line in lines:
-        print(f"Tokenizing line: {line}")
-        tagged_line = tagger(line)
-        for word in tagged_line:
-            print(f"Tokenizing word: {word.surface}, Lemma: {word.feature.lemma}, POS1: {word.feature.pos1}")
+        tagged_line = [Token(word.surface, word.feature, word.pos) for word in tagger(line)]
         line_list.append(tagged_line)
     return line_list
 
@@ -264,35 +332,44 @@ TODO: Make considerations on JISHO API (maybe query it when JMDict fails)
 TODO: Make an edge case dictionary (for words that get incorrectly tokenized)
 '''
 def get_word_info(word, type="word"):
+    cached = word_cache.get(word, type)
+    if cached is not None:
+        return cached
+    word_info = lookup_word_info(word, type)
+    word_cache.put(word, type, word_info)
+    return word_info
+
+# uncached dictionary lookup behind get_word_info
+def lookup_word_info(word, type="word"):
     try:
-        result = jam.lookup(word)
+        result = jmdict.lookup(word)
     except Exception as e:
         return []
     word_info = []
-    for entry in result.entries: 
+    for entry in result: 
         # print(f"Processing entry: {entry}")
         common = False
-        if type == "particle" and not ("conjunction" in entry.senses[0].pos or "particle" in entry.senses[0].pos):
+        if type == "particle" and not ("conjunction" in entry["senses"][0]["pos"] or "particle" in entry["senses"][0]["pos"]):
             continue
-        for kanji in entry.kanji_forms:
-            #kanji contains text and info
-            if kanji.text == word and kanji.pri and "news1" in kanji.pri:
+        for kanji in entry["kanji"]:
+            #kanji contains text and pri
+            if kanji["text"] == word and kanji["pri"] and "news1" in kanji["pri"]:
                 common = True
                 break
         # Limit to 3 entries
-        idseq = entry.idseq
-        if entry.kanji_forms:
-            word_text = entry.kanji_forms[0].text
+        idseq = entry["idseq"]
+        if entry["kanji"]:
+            word_text = entry["kanji"][0]["text"]
         else:
-            word_text = entry.kana_forms[0].text
-        furigana = entry.kana_forms[0].text
-        romaji = kakasi.convert(furigana)[0]["hepburn"]
+            word_text = entry["kana"][0]["text"]
+        furigana = entry["kana"][0]["text"]
+        romaji = to_romaji(furigana)
         word_properties = []
         
         # limit definitions to 3
-        for sense in entry.senses[:3]:
-            pos = sense.pos
-            definition = [sense_gloss.text for sense_gloss in sense.gloss]
+        for sense in entry["senses"][:3]:
+            pos = sense["pos"]
+            definition = list(sense["gloss"])
             word_properties.append({
                 "pos": pos,
                 "definition": definition
@@ -376,22 +453,21 @@ def process_tokenized_lines(lines):
                 or word.feature.pos1 == '副詞'):
                 #retrieve definition from dictionary.
                 word_info = get_word_info(word.feature.lemma)
-                for info in word_info:
-                    info['furigana'] = conv.do(word.surface)
-                    info['romaji'] = kakasi.convert(info['furigana'])[0]["hepburn"]
-                
-                base_word_data = deepcopy(word_info)
-                
-                base_furigana = conv.do(word.feature.lemma)
-                base_romaji = kakasi.convert(base_furigana)[0]["hepburn"]
-                
-                for info in base_word_data:
-                    info['word'] = word.feature.lemma
-                    info['furigana'] = base_furigana
-                    info['romaji'] = base_romaji
+                surface_furigana = to_furigana(word.surface)
+                surface_romaji = to_romaji(surface_furigana)
+                base_furigana = to_furigana(word.feature.lemma)
+                base_romaji = to_romaji(base_furigana)
+
+                # root records share their definitions with the composite ones; modify_definitions never changes them in place
+                base_word_data = [
+                    {**info, 'word': word.feature.lemma, 'furigana': base_furigana, 'romaji': base_romaji}
+                    for info in word_info
+                ]
                     
                 for info in word_info:
                     info['word'] = word.surface
+                    info['furigana'] = surface_furigana
+                    info['romaji'] = surface_romaji
                     
                 final_word = word.surface
                 pos += 1
@@ -402,8 +478,8 @@ def process_tokenized_lines(lines):
                     # print(f"Processing auxiliary: {line[pos].surface}, Lemma: {line[pos].feature.lemma}, POS1: {line[pos].feature.pos1}")
                     aux_word = line[pos]
                     final_word += aux_word.surface
-                    aux_furigana = conv.do(aux_word.surface)
-                    aux_romaji = kakasi.convert(aux_word.surface)[0]["hepburn"]
+                    aux_furigana = to_furigana(aux_word.surface)
+                    aux_romaji = to_romaji(aux_word.surface)
                     for info in word_info:
                         info['furigana'] += aux_furigana
                         info['romaji'] += aux_romaji
@@ -456,8 +532,8 @@ def process_tokenized_lines(lines):
                     temp_list.append({
                         "idseq": "none",
                         "word": suffix.surface,
-                        "furigana": conv.do(suffix.surface),
-                        "romaji": kakasi.convert(suffix.surface)[0]["hepburn"],
+                        "furigana": to_furigana(suffix.surface),
+                        "romaji": to_romaji(suffix.surface),
                         "definitions": temp_properties
                     })
                     
@@ -544,8 +620,8 @@ def process_tokenized_lines(lines):
                         temp_list.append({
                             "idseq": "none",
                             "word": word.surface,
-                            "furigana": conv.do(word.surface),
-                            "romaji": kakasi.convert(word.surface)[0]["hepburn"],
+                            "furigana": to_furigana(word.surface),
+                            "romaji": to_romaji(word.surface),
                             "definitions": temp_properties
                         })
                         full_word_data = {
@@ -560,68 +636,247 @@ def process_tokenized_lines(lines):
         lyrics.append(new_line)
     return word_dict, lyrics
 
-# Modify definitions to include auxiliary meanings
+# Modify definitions to include auxiliary meanings. Returns new definition records (copy on write), since the
+# lists it gets may be shared with root records.
 def modify_definitions(definitions_list, aux_meanings):
     if aux_meanings:
-        for i, definition in enumerate(definitions_list):
-            aux_str = ", ".join(aux_meanings)
-            definitions_list[i]['definition'].append(aux_str)
+        aux_str = ", ".join(aux_meanings)
+        return [{**definition, 'definition': definition['definition'] + [aux_str]} for definition in definitions_list]
     return definitions_list
 
+# the forms a song's rules and dictionary lookups can match on: each Japanese token's surface and lemma,
+# plus noun + suffix surfaces, which are looked up together. Stored as SongData.lemmas for reprocess.py.
+def lookup_forms(tokenized_lines):
+    forms = set()
+    for line in tokenized_lines:
+        for pos, word in enumerate(line):
+            if not is_japanese(word.surface):
+                continue
+            forms.add(word.surface)
+            if word.feature.lemma:
+                forms.add(word.feature.lemma)
+            if word.feature.pos1 == '接尾辞' and pos > 0 and is_japanese(line[pos - 1].surface):
+                forms.add(line[pos - 1].surface + word.surface)
+    return forms
+
+# every JMdict idseq a song's word mapping uses. Stored as SongData.idseqs for reprocess.py.
+def mapping_idseqs(word_mapping):
+    idseqs = set()
+    for data in word_mapping.values():
+        # known suffixes are stored as a bare entry list rather than root/suffixes/composite
+        entries = data if isinstance(data, list) else (data["root"] or []) + data["composite"]
+        idseqs.update(entry["idseq"] for entry in entries if isinstance(entry["idseq"], int))
+    return idseqs
+
 def convert_to_hiragana(lyrics):
     hiragana_lyrics = []
     for line in lyrics:
         hiragana_line = []
         for word in line:
-            hiragana_line.append(conv.do(word))
+            hiragana_line.append(to_furigana(word))
         hiragana_lyrics.append(hiragana_line)
     return hiragana_lyrics
 
+# runs the full pipeline for one song's lyrics
+def process_lyrics(cleaned_lyrics):
+    start = time.perf_counter()
+    lines = split_into_lines(cleaned_lyrics)
+    split_ms = (time.perf_counter() - start) * 1000
+    word_mapping, lyrics, hiragana_lines, forms, timings = process_lines(lines)
+    return word_mapping, lyrics, hiragana_lines, forms, {"split_into_lines": split_ms, **timings}
+
+# returns (word_mapping, lyrics, hiragana_lines, lookup forms, timings), where timings holds each stage's wall time in ms
+def process_lines(lines):
+    timings = {}
+    start = time.perf_counter()
+
+    def lap(stage):
+        nonlocal start
+        now = time.perf_counter()
+        timings[stage] = (now - start) * 1000
+        start = now
+
+    checked_lines = dakuten_check(lines)
+    lap("dakuten_check")
+    tokenized_lines = tokenize(checked_lines)
+    lap("tokenize")
+    word_mapping, lyrics = process_tokenized_lines(tokenized_lines)
+    lap("process_tokenized_lines")
+    hiragana_lines = convert_to_hiragana(lyrics)
+    lap("convert_to_hiragana")
+    # pool processes have their own cache connection; get new lookups onto disk for the others
+    word_cache.flush()
+    return word_mapping, lyrics, hiragana_lines, lookup_forms(tokenized_lines), timings
+
+'''
+Merges the results of consecutive line chunks back in order. The first chunk to map a word wins, the same
+as a single pass where later occurrences are skipped. One difference from a single pass: a verb repeated in
+a later chunk keeps its auxiliaries attached there, since that chunk sees it for the first time.
 '''
-The main processing code. SQS will send a message to this lambda function, which will then process the lyrics.
+def merge_line_chunks(chunks):
+    word_mapping = {}
+    lyrics = []
+    hiragana_lines = []
+    forms = set()
+    timings = {}
+    for chunk_mapping, chunk_lyrics, chunk_hiragana, chunk_forms, chunk_timings in chunks:
+        for word, data in chunk_mapping.items():
+            word_mapping.setdefault(word, data)
+        lyrics.extend(chunk_lyrics)
+        hiragana_lines.extend(chunk_hiragana)
+        forms.update(chunk_forms)
+        # chunks run side by side, so each stage adds up the chunks' times rather than the song's wall time
+        for stage, ms in chunk_timings.items():
+            timings[stage] = timings.get(stage, 0.0) + ms
+    return word_mapping, lyrics, hiragana_lines, forms, timings
+
+# processes every song in a batch, spreading them over the process pool when there is more than one core.
+# returns a (word_mapping, lyrics, hiragana_lines, lookup forms, timings) tuple per song, or the exception that song raised.
+# Songs not finished within `timeout` seconds (None waits for all of them) come back as a WorkerError.
+def process_songs(lyrics_list, timeout=None):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    if POOL_SIZE <= 1 or not lyrics_list:
+        results = []
+        for cleaned_lyrics in lyrics_list:
+            if deadline is not None and time.monotonic() > deadline:
+                # a song in progress can't be interrupted inline, but the ones after it aren't started
+                results.append(WorkerError("timed out"))
+                continue
+            try:
+                results.append(process_lyrics(cleaned_lyrics))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    # children open their own cache connection, so make sure everything we have is on disk first. The connection is
+    # closed rather than inherited since SQLite connections can't cross fork; it reopens on the next lookup.
+    word_cache.close()
+    if len(lyrics_list) == 1:
+        lines = split_into_lines(lyrics_list[0])
+        if POOL_SPLIT_LINES and len(lines) >= POOL_SPLIT_LINES:
+            size = -(-len(lines) // POOL_SIZE)
+            chunks = get_pool().map(process_lines, [(lines[i:i + size],) for i in range(0, len(lines), size)], timeout)
+            failed = [chunk for chunk in chunks if isinstance(chunk, WorkerError)]
+            return [failed[0] if failed else merge_line_chunks(chunks)]
+        try:
+            return [process_lines(lines)]
+        except Exception as e:
+            return [e]
+    return get_pool().map(process_lyrics, [(cleaned_lyrics,) for cleaned_lyrics in lyrics_list], timeout)
+
+# adds the stored response payloads to each row. kanji_data is written by the API, so it is read back in one query per batch.
+def add_payloads(supabase, rows):
+    try:
+        titles = list({row["title"] for row in rows})
+        response = supabase.table("SongData").select("title, artist, kanji_data").in_("title", titles).execute()
+        kanji_by_song = {(song["title"], song["artist"]): song["kanji_data"] for song in response.data}
+        for row in rows:
+            row.update(build_payload(row, kanji_by_song.get((row["title"], row["artist"]))))
+    except Exception as e:
+        # get-song falls back to building the body itself when no payload is stored
+        print(f"Could not build song payloads: {e}")
+
+# writes processed songs with a single round trip (see db/migrations). Returns the indexes of rows that matched
+# no SongData row (e.g. a song deleted since it was queued), which were not written.
+def write_song_data(rows):
+    supabase = get_supabase()
+    add_payloads(supabase, rows)
+    rows, entries = store_rows(rows)
+    updated = supabase.rpc("update_song_data_batch", {"rows": rows, "entries": entries}).execute().data
+    if len(stored_entry_ids) > MAX_STORED_ENTRY_IDS:
+        stored_entry_ids.clear()
+    stored_entry_ids.update(entry["id"] for entry in entries)
+    if updated == len(rows):
+        return []
+    # the batch only returns a count; rewrite the rows one at a time to find the ones that matched nothing
+    return [i for i, row in enumerate(rows) if supabase.rpc("update_song_data_batch", {"rows": [row]}).execute().data != 1]
+
+# swaps each row's word_mapping for word_refs (see lexicon/word_entries.py) and collects the entries to add to WordEntry
+def store_rows(rows):
+    entries = {}
+    for row in rows:
+        word_refs, row_entries = split_word_mapping(row.pop("word_mapping"))
+        row["word_refs"] = word_refs
+        entries.update((id, entry) for id, entry in row_entries.items() if id not in stored_entry_ids)
+    return rows, [
+        {"id": id, "idseq": entry["idseq"] if isinstance(entry["idseq"], int) else None, "entry": entry}
+        for id, entry in entries.items()
+    ]
+
+'''
+The main processing code. SQS will send a batch of messages to this lambda function, which will then process the lyrics.
 The lyrics are split into lines, tokenized, and then processed. The processed lyrics are then updated in the database.
+
+Each record is processed in isolation: a bad message only fails itself, and the failed message ids are
+returned as batchItemFailures so SQS retries just those (the event source mapping must have
+ReportBatchItemFailures enabled). Successful records are written together in one bulk update.
 '''
 def lambda_handler(event, context):
-    try:
-        # print("Lambda handler invoked.")
-        for record in event['Records']:
-            try:
-                body = json.loads(record['body'])
-                # print(f"Processing record: {body}")
-            except json.JSONDecodeError as e:
-                print(f"JSON decoding error: {e}")
-                return {
-                    'statusCode': 400,
-                    'body': json.dumps(f'JSON decoding error: {e}')
-                }
+    batch_item_failures = []
+    bodies = []
+    message_ids = []
+    # print("Lambda handler invoked.")
+    for record in event['Records']:
+        try:
+            body = json.loads(record['body'])
+            # print(f"Processing record: {body}")
+            if not all(key in body for key in ('cleaned_lyrics', 'artist', 'song')):
+                raise ValueError("message is missing cleaned_lyrics, artist or song")
+        except Exception as e:
+            print(f"Error reading record {record['messageId']}: {e}")
+            batch_item_failures.append({"itemIdentifier": record['messageId']})
+            continue
+        bodies.append(body)
+        message_ids.append(record['messageId'])
+
+    rows = []
+    row_message_ids = []
+    row_timings = []
+    # a hung or killed pool process fails only its own records, before the Lambda timeout retries the whole batch
+    timeout = None
+    if context is not None:
+        remaining = context.get_remaining_time_in_millis() / 1000
+        timeout = remaining - min(WRITE_RESERVE_SECONDS, remaining / 2)
+    results = process_songs([body['cleaned_lyrics'] for body in bodies], timeout)
+    for message_id, body, result in zip(message_ids, bodies, results):
+        if isinstance(result, Exception):
+            print(f"Error processing record {message_id}: {result}")
+            batch_item_failures.append({"itemIdentifier": message_id})
+            continue
 
-            cleaned_lyrics = body['cleaned_lyrics']
-            artist = body['artist']
-            song = body['song']
-            access_token = body['access_token']
-            refresh_token = body['refresh_token']
-
-            lines = split_into_lines(cleaned_lyrics)
-            checked_lines = dakuten_check(lines)
-            tokenized_lines = tokenize(checked_lines)
-            word_mapping, lyrics = process_tokenized_lines(tokenized_lines)
-            hiragana_lines = convert_to_hiragana(lyrics)
-
-            supabase.auth.set_session(access_token, refresh_token)
-            response = supabase.table("SongData").update({
-                "lyrics": lyrics, "hiragana_lyrics": hiragana_lines, "word_mapping": word_mapping
-            }).eq("title", song).eq("artist", artist).execute()
-
-        return {
-            'statusCode': 200,
-            'body': json.dumps('Long-running task completed successfully.')
-        }
-    except Exception as e:
-        print(f"Error in lambda_handler: {e}")
-        return {
-            'statusCode': 400,
-            'body': json.dumps(f'Long-running task failed with error: {e}')
-        }
+        word_mapping, lyrics, hiragana_lines, forms, timings = result
+        row_timings.append({
+            "event": "record_timing", "message_id": message_id, "song": body['song'], "artist": body['artist'],
+            "lines": len(lyrics), "stages": {stage: round(ms, 1) for stage, ms in timings.items()}
+        })
+        rows.append({
+            "title": body['song'], "artist": body['artist'], "song_key": body.get('song_key'), "lyrics": lyrics, "hiragana_lyrics": hiragana_lines, "word_mapping": word_mapping,
+            # what reprocess.py needs to tell whether this row is stale, and to requeue it
+            "source_lyrics": body['cleaned_lyrics'], "pipeline_version": PIPELINE_VERSION, "dictionary_version": jmdict.version,
+            "lemmas": sorted(forms), "idseqs": sorted(mapping_idseqs(word_mapping))
+        })
+        row_message_ids.append(message_id)
+
+    if rows:
+        start = time.perf_counter()
+        try:
+            unmatched = write_song_data(rows)
+        except Exception as e:
+            print(f"Error writing song data for {len(rows)} songs: {e}")
+            unmatched = range(len(rows))
+        else:
+            for i in unmatched:
+                print(f"Song data for record {row_message_ids[i]} matched no SongData row")
+        batch_item_failures.extend({"itemIdentifier": row_message_ids[i]} for i in unmatched)
+        write_ms = round((time.perf_counter() - start) * 1000, 1)
+        # one structured line per record; the batch write is shared, so every record reports the same write_ms
+        for record_timing in row_timings:
+            record_timing["write_ms"] = write_ms
+            print(json.dumps(record_timing, ensure_ascii=False))
+
+    word_cache.flush()
+    print(json.dumps({"word_cache": word_cache.stats()}))
+    return {"batchItemFailures": batch_item_failures}
 
 
 
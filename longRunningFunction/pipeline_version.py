@@ -0,0 +1,49 @@
+import ast
+import hashlib
+import json
+
+'''
+Version stamp for processed songs.
+
+Every SongData row the worker writes records the pipeline version it was processed with: a hash of the
+rule tables in main.py plus PIPELINE_REVISION, which is bumped by hand whenever the processing code
+itself changes (process_tokenized_lines, tokenizing, ...). Edits to the tables change the version on
+their own. reprocess.py compares versions (and the tables behind them) to find the rows that are stale.
+'''
+
+# module level tables in main.py that decide what a song is processed into
+RULE_TABLES = ["AUXILIARIES", "SUFFIX_DICT", "ADDITIONAL_SUFFIXES", "DAKUTEN_MAP", "HANDAKUTEN_MAP"]
+
+
+def pipeline_version(revision, tables):
+    """
+    Args:
+        revision: PIPELINE_REVISION
+        tables: RULE_TABLES name -> value
+
+    Returns:
+        A version string such as "3-1a2b3c4d5e6f"
+    """
+    encoded = json.dumps([tables[name] for name in RULE_TABLES], ensure_ascii=False, sort_keys=True)
+    return f"{revision}-{hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:12]}"
+
+
+def rules_from_source(source):
+    # (revision, tables) as written in a main.py source, without importing it (e.g. an older revision from git)
+    values = {}
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if name == "PIPELINE_REVISION" or name in RULE_TABLES:
+                values[name] = ast.literal_eval(node.value)
+    return values.get("PIPELINE_REVISION", 0), {name: values[name] for name in RULE_TABLES}
+
+
+def changed_forms(old_tables, new_tables):
+    # forms (auxiliary lemmas, suffixes) whose rule was added, removed or changed between two versions of the tables
+    forms = set()
+    for name in ("AUXILIARIES", "SUFFIX_DICT"):
+        old, new = old_tables[name], new_tables[name]
+        forms.update(form for form in old.keys() | new.keys() if old.get(form) != new.get(form))
+    forms.update(set(old_tables["ADDITIONAL_SUFFIXES"]) ^ set(new_tables["ADDITIONAL_SUFFIXES"]))
+    return forms
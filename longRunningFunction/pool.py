@@ -0,0 +1,128 @@
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+
+'''
+A small process pool that works inside Lambda.
+
+multiprocessing.Pool and concurrent.futures.ProcessPoolExecutor both rely on semaphores in /dev/shm,
+which Lambda does not provide, so this pool only uses Process and Pipe. Processes are forked once,
+run `initializer` (so each one builds its own tagger, converter and dictionary handle), and are then
+kept for the life of the execution environment so warm invocations reuse them.
+'''
+
+
+class WorkerError(Exception):
+    pass
+
+
+def _worker_loop(conn, initializer):
+    initializer()
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        index, fn, args = task
+        try:
+            conn.send((index, True, fn(*args)))
+        except Exception as e:
+            conn.send((index, False, f"{type(e).__name__}: {e}"))
+
+
+class ProcessPool:
+    def __init__(self, size, initializer):
+        self.size = size
+        self.initializer = initializer
+        self.context = multiprocessing.get_context("fork")
+        self.workers = []
+
+    def _ensure_workers(self):
+        # replace any process that died since the last map
+        alive = []
+        for process, conn in self.workers:
+            if process.is_alive():
+                alive.append((process, conn))
+            else:
+                conn.close()
+        self.workers = alive
+        while len(self.workers) < self.size:
+            parent_conn, child_conn = self.context.Pipe()
+            process = self.context.Process(target=_worker_loop, args=(child_conn, self.initializer), daemon=True)
+            process.start()
+            child_conn.close()
+            self.workers.append((process, parent_conn))
+
+    def _kill(self, process, conn):
+        # a process still busy at the deadline can't be trusted to answer the next map, so it is replaced
+        process.kill()
+        process.join(timeout=1)
+        conn.close()
+        self.workers = [(p, c) for p, c in self.workers if p is not process]
+
+    def map(self, fn, args_list, timeout=None):
+        """
+        Run fn(*args) for every args tuple across the pool.
+
+        Args:
+            fn: Module level function (it is pickled by reference)
+            args_list: List of argument tuples, one per task
+            timeout: Seconds to wait for the whole map, or None to wait until every task finishes
+
+        Returns:
+            Results in the same order as args_list. A task that raised, or didn't finish before the timeout,
+            holds a WorkerError instead.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._ensure_workers()
+        results = [None] * len(args_list)
+        pending = list(enumerate(args_list))[::-1]
+        idle = list(self.workers)
+        busy = {}
+        while pending or busy:
+            while pending and idle:
+                process, conn = idle.pop()
+                index, args = pending.pop()
+                try:
+                    conn.send((index, fn, args))
+                except (BrokenPipeError, OSError):
+                    # the process died while idle; the task fails and the process is replaced on the next map
+                    results[index] = WorkerError("worker process exited")
+                    continue
+                busy[conn] = (process, index)
+            if not busy:
+                # every process died; fail whatever is left rather than wait forever
+                for index, _ in pending:
+                    results[index] = WorkerError("no worker processes available")
+                break
+            ready = wait(list(busy), None if deadline is None else max(deadline - time.monotonic(), 0))
+            if not ready:
+                # out of time: whatever is running or still queued fails, and the busy processes are killed
+                for conn, (process, index) in busy.items():
+                    results[index] = WorkerError("timed out")
+                    self._kill(process, conn)
+                for index, _ in pending:
+                    results[index] = WorkerError("timed out")
+                break
+            for conn in ready:
+                process, index = busy.pop(conn)
+                try:
+                    index, ok, value = conn.recv()
+                except (EOFError, OSError):
+                    results[index] = WorkerError("worker process exited")
+                    continue
+                results[index] = value if ok else WorkerError(value)
+                idle.append((process, conn))
+        return results
+
+    def close(self):
+        for process, conn in self.workers:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+            process.join(timeout=1)
+        self.workers = []
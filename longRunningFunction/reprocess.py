@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from dotenv import load_dotenv
+from supabase import create_client
+from lexicon.jmdict_index import JMdictIndex
+from pipeline_version import pipeline_version, rules_from_source, changed_forms
+
+'''
+Requeues processed songs whose output may change after a rule or dictionary update, instead of the whole catalog.
+
+Every SongData row the worker writes is stamped with its pipeline version, dictionary version, the forms
+(token surfaces and lemmas) its rules and lookups matched on, and the JMdict idseqs it uses (db/migrations/0008).
+This job diffs the old and new rules or dictionary, and requeues the rows on the old version that touch something
+that changed. Rows that don't touch anything changed are restamped with the new version without reprocessing.
+From longRunningFunction/, with the repository root on PYTHONPATH:
+
+    python reprocess.py --rules-from origin/main          # AUXILIARIES/SUFFIX_DICT edits since that revision
+    python reprocess.py --dictionary-from old_jmdict.idx  # after a jamdict-data update (the old index is kept by hand)
+    python reprocess.py --stale                           # everything not on the current versions, e.g. after a PIPELINE_REVISION bump
+    python reprocess.py --lemma 為る --idseq 1157170       # specific forms or entries
+
+--dry-run only reports what would be requeued. Rows processed before versions were stored can't be targeted
+(and have no source lyrics to requeue); they are counted in the report.
+'''
+
+WORKER_DIR = os.path.dirname(os.path.realpath(__file__))
+PAGE_SIZE = 1000
+# rows per restamp update (song keys go in the URL)
+RESTAMP_CHUNK = 100
+# SQS limits for one send_message_batch call
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+COLUMNS = "title, artist, song_key, source_lyrics, pipeline_version, dictionary_version, lemmas, idseqs"
+
+
+def current_rules():
+    with open(os.path.join(WORKER_DIR, "main.py"), "r", encoding="utf-8") as file:
+        return rules_from_source(file.read())
+
+
+def rules_at(revision):
+    source = subprocess.run(["git", "show", f"{revision}:./main.py"], cwd=WORKER_DIR, capture_output=True, text=True, check=True).stdout
+    return rules_from_source(source)
+
+
+def song_data(supabase):
+    return supabase.table("SongData").select(COLUMNS)
+
+
+def all_rows(query):
+    # `query` builds a fresh filtered select; rows are paged in a stable order
+    start = 0
+    while True:
+        rows = query().order("title").order("artist").range(start, start + PAGE_SIZE - 1).execute().data
+        yield from rows
+        if len(rows) < PAGE_SIZE:
+            break
+        start += PAGE_SIZE
+
+
+def split_affected(rows, forms, idseqs):
+    # (rows that use a changed form or entry, rows that don't)
+    affected, unaffected = [], []
+    for row in rows:
+        if forms.intersection(row["lemmas"] or ()) or idseqs.intersection(row["idseqs"] or ()):
+            affected.append(row)
+        else:
+            unaffected.append(row)
+    return affected, unaffected
+
+
+def restamp(supabase, rows, column, version):
+    # rows whose output can't change are marked as processed with the new version
+    keys = [row["song_key"] for row in rows if row["song_key"]]
+    for i in range(0, len(keys), RESTAMP_CHUNK):
+        supabase.table("SongData").update({column: version}).in_("song_key", keys[i:i + RESTAMP_CHUNK]).execute()
+    return len(keys)
+
+
+def message_batches(rows):
+    batch, size = [], 0
+    for row in rows:
+        body = json.dumps({"song": row["title"], "artist": row["artist"], "song_key": row["song_key"], "cleaned_lyrics": row["source_lyrics"]})
+        if batch and (len(batch) == MAX_BATCH_ENTRIES or size + len(body.encode("utf-8")) > MAX_BATCH_BYTES):
+            yield batch
+            batch, size = [], 0
+        batch.append({"Id": str(len(batch)), "MessageBody": body})
+        size += len(body.encode("utf-8"))
+    if batch:
+        yield batch
+
+
+def requeue(rows, queue_url):
+    import boto3
+    sqs = boto3.client("sqs", region_name="us-east-2")
+    sent = 0
+    for batch in message_batches(rows):
+        response = sqs.send_message_batch(QueueUrl=queue_url, Entries=batch)
+        sent += len(response.get("Successful", []))
+        for failure in response.get("Failed", []):
+            print(f"Could not requeue {json.loads(batch[int(failure['Id'])]['MessageBody'])['song_key']}: {failure.get('Message')}")
+    return sent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Requeue only the songs affected by a rule or dictionary change.")
+    parser.add_argument("--rules-from", metavar="REVISION", help="git revision of main.py the catalog was processed with")
+    parser.add_argument("--dictionary-from", metavar="INDEX", help="JMdict index the catalog was processed with")
+    parser.add_argument("--stale", action="store_true", help="requeue every row not on the current pipeline and dictionary versions")
+    parser.add_argument("--lemma", nargs="*", default=[], help="requeue rows that matched on these forms")
+    parser.add_argument("--idseq", nargs="*", type=int, default=[], help="requeue rows that use these JMdict entries")
+    parser.add_argument("--dry-run", action="store_true", help="report without requeueing or restamping")
+    args = parser.parse_args()
+
+    load_dotenv()
+    # restamping updates SongData, which RLS only lets the service role do without a user session
+    supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_ROLE_KEY"))
+    revision, tables = current_rules()
+    current_pipeline = pipeline_version(revision, tables)
+    current_dictionary = JMdictIndex().version
+
+    affected = []
+    restamps = []
+    if args.rules_from:
+        old_revision, old_tables = rules_at(args.rules_from)
+        old_pipeline = pipeline_version(old_revision, old_tables)
+        rows = list(all_rows(lambda: song_data(supabase).eq("pipeline_version", old_pipeline)))
+        if old_revision != revision or any(old_tables[name] != tables[name] for name in ("DAKUTEN_MAP", "HANDAKUTEN_MAP")):
+            # processing code or character normalization changed, which can affect any song
+            print(f"PIPELINE_REVISION or the dakuten maps changed since {args.rules_from}; every row on {old_pipeline} is affected")
+            affected += rows
+        else:
+            forms = changed_forms(old_tables, tables)
+            print(f"Rules changed for {len(forms)} forms since {args.rules_from}: {' '.join(sorted(forms))}")
+            rule_affected, unaffected = split_affected(rows, forms, set())
+            affected += rule_affected
+            restamps.append((unaffected, "pipeline_version", current_pipeline))
+    if args.dictionary_from:
+        old_index = JMdictIndex(args.dictionary_from)
+        idseqs, forms = JMdictIndex().changed_since(old_index)
+        print(f"{old_index.version} -> {current_dictionary}: {len(idseqs)} entries and {len(forms)} forms changed")
+        rows = list(all_rows(lambda: song_data(supabase).eq("dictionary_version", old_index.version)))
+        dictionary_affected, unaffected = split_affected(rows, forms, idseqs)
+        affected += dictionary_affected
+        restamps.append((unaffected, "dictionary_version", current_dictionary))
+    if args.stale:
+        affected += all_rows(lambda: song_data(supabase).or_(f'pipeline_version.neq."{current_pipeline}",dictionary_version.neq."{current_dictionary}"'))
+    if args.lemma:
+        affected += all_rows(lambda: song_data(supabase).ov("lemmas", args.lemma))
+    if args.idseq:
+        affected += all_rows(lambda: song_data(supabase).ov("idseqs", args.idseq))
+    if not (args.rules_from or args.dictionary_from or args.stale or args.lemma or args.idseq):
+        parser.error("nothing to reprocess; pass --rules-from, --dictionary-from, --stale, --lemma or --idseq")
+
+    # a row can be selected by more than one option; requeued rows are restamped by the worker instead
+    unique = {(row["title"], row["artist"]): row for row in affected}
+    requeueable = [row for row in unique.values() if row["source_lyrics"]]
+    untracked = supabase.table("SongData").select("title", count="exact").is_("pipeline_version", "null").not_.is_("lyrics", "null").limit(1).execute().count
+    print(f"{len(unique)} affected rows, {len(unique) - len(requeueable)} without source lyrics; {untracked} rows processed before versions were stored")
+    if args.dry_run:
+        for row in requeueable:
+            print(f"  {row['artist']} - {row['title']}")
+        sys.exit(0)
+
+    print(f"Requeued {requeue(requeueable, os.getenv('QUEUE_URL'))} of {len(requeueable)} rows")
+    for rows, column, version in restamps:
+        rows = [row for row in rows if (row["title"], row["artist"]) not in unique]
+        print(f"Restamped {restamp(supabase, rows, column, version)} unaffected rows with {column} {version}")
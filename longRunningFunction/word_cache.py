@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import sqlite3
+from collections import OrderedDict
+
+'''
+Two tier cache for get_word_info results, keyed by (word, type, dictionary version).
+
+Tier 1 is an in-process LRU with a size bound. Tier 2 is a SQLite file in /tmp, which survives
+warm Lambda reuse. On a cold start the /tmp file is seeded from the copy baked into the image
+(built for the most common JMdict lemmas), so the first songs after a deploy already hit.
+
+Values are stored as JSON text and decoded on every hit. process_tokenized_lines mutates the
+lists it gets back, so each caller has to receive its own copy anyway.
+
+The SQLite connection is opened on first use. SQLite connections can't be used across fork, so the
+worker close()s it before forking pool processes; each process then opens its own.
+'''
+
+WORKER_DIR = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_CACHE_PATH = "/tmp/word_cache.sqlite"
+DEFAULT_SEED_PATH = os.path.join(WORKER_DIR, "word_cache.sqlite")
+DEFAULT_MAXSIZE = 4096
+# pending disk writes are committed in one short transaction at least this often
+COMMIT_EVERY = 200
+# if the disk store stays locked (e.g. by another pool process) pending writes are dropped past this point
+MAX_PENDING = 5000
+
+
+class WordCache:
+    def __init__(self, version, path=None, seed_path=None, maxsize=None):
+        self.version = version
+        self.path = path or os.getenv("WORD_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.seed_path = seed_path or os.getenv("WORD_CACHE_SEED", DEFAULT_SEED_PATH)
+        self.maxsize = maxsize or int(os.getenv("WORD_CACHE_SIZE", DEFAULT_MAXSIZE))
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.pending = []
+        self.conn = None
+        self.disk_unavailable = False
+
+    def connection(self):
+        # the disk store's connection, opened on first use (and again after close()), or None if it can't be opened
+        if self.conn is None and not self.disk_unavailable:
+            try:
+                self.conn = self._open_disk()
+            except sqlite3.Error as e:
+                # the in-memory tier still works without a disk store
+                print(f"Word cache disk store unavailable: {e}")
+                self.disk_unavailable = True
+        return self.conn
+
+    def _open_disk(self):
+        if not os.path.exists(self.path) and self.seed_path != self.path and os.path.exists(self.seed_path):
+            shutil.copyfile(self.seed_path, self.path)
+        conn = sqlite3.connect(self.path, timeout=1, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS word_info ("
+            " word TEXT NOT NULL, type TEXT NOT NULL, version TEXT NOT NULL, value TEXT NOT NULL,"
+            " PRIMARY KEY (word, type, version))"
+        )
+        # entries from an older dictionary can never be hit again
+        conn.execute("DELETE FROM word_info WHERE version != ?", (self.version,))
+        conn.commit()
+        return conn
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def get(self, word, type="word"):
+        key = (word, type)
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return json.loads(value)
+        conn = self.connection()
+        if conn is not None:
+            try:
+                row = conn.execute(
+                    "SELECT value FROM word_info WHERE word = ? AND type = ? AND version = ?",
+                    (word, type, self.version),
+                ).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is not None:
+                self._remember(key, row[0])
+                self.disk_hits += 1
+                return json.loads(row[0])
+        self.misses += 1
+        return None
+
+    def put(self, word, type, info):
+        value = json.dumps(info, ensure_ascii=False)
+        self._remember((word, type), value)
+        if not self.disk_unavailable:
+            self.pending.append((word, type, self.version, value))
+            if len(self.pending) >= COMMIT_EVERY:
+                self.flush()
+
+    def flush(self):
+        # a failed write only costs a future cache miss, so errors are never raised to the caller
+        if not self.pending or self.connection() is None:
+            return
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO word_info (word, type, version, value) VALUES (?, ?, ?, ?)",
+                    self.pending,
+                )
+            self.pending = []
+        except sqlite3.Error as e:
+            print(f"Word cache write failed: {e}")
+            if len(self.pending) > MAX_PENDING:
+                self.pending = []
+
+    def close(self):
+        # writes out pending entries and closes the connection; the next lookup reopens it
+        self.flush()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "memory_size": len(self.memory),
+            "version": self.version,
+        }
+
+
+NEWS_FREQUENCY = re.compile(r"nf(\d+)")
+
+
+def common_lemmas(jmdict, top):
+    """
+    Rank JMdict headwords by their newspaper frequency band (nf01 is the 500 most common words).
+
+    Args:
+        jmdict: JMdictIndex to read entries from
+        top: Number of lemmas to return
+
+    Returns:
+        List of the `top` most common headwords, most common first
+    """
+    ranked = []
+    for entry in jmdict.entries():
+        for form in entry["kanji"] + entry["kana"]:
+            bands = [int(match.group(1)) for pri in form["pri"] for match in [NEWS_FREQUENCY.fullmatch(pri)] if match]
+            if bands:
+                ranked.append((min(bands), entry["idseq"], form["text"]))
+    ranked.sort()
+    lemmas = []
+    seen = set()
+    for _, _, text in ranked:
+        if text not in seen:
+            seen.add(text)
+            lemmas.append(text)
+    return lemmas[:top]
+
+
+if __name__ == "__main__":
+    # Bakes a seed cache for the image: python word_cache.py --top 5000
+    parser = argparse.ArgumentParser(description="Build the seed word cache for the most common lemmas.")
+    parser.add_argument("--top", type=int, default=5000, help="number of lemmas to precompute")
+    parser.add_argument("--out", default=DEFAULT_SEED_PATH, help="output path for the seed cache")
+    args = parser.parse_args()
+
+    if os.path.exists(args.out):
+        os.remove(args.out)
+    os.environ["WORD_CACHE_PATH"] = args.out
+    os.environ["WORD_CACHE_SEED"] = args.out
+    import main
+
+    for lemma in common_lemmas(main.jmdict, args.top):
+        main.get_word_info(lemma)
+    main.word_cache.flush()
+    main.word_cache.connection().execute("PRAGMA journal_mode=DELETE")
+    print(f"Seeded {args.out} with {main.word_cache.stats()['misses']} lookups for {main.jmdict.version}")
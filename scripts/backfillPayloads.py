@@ -0,0 +1,43 @@
+from db.supabase import create_service_client
+from app.entry_store import song_word_mapping
+from lexicon.song_payload import build_payload
+from scripts.backfillSongKeys import all_rows
+
+# Builds the stored /song/get-song payloads for processed songs that don't have one: songs processed before migration 0004,
+# and every song after migration 0013 cleared them. Without a payload, get-song rebuilds the body on every request.
+# Run from the repository root: python -m scripts.backfillPayloads
+# Install brotli first, or only the gzip payload is stored. Writes go through the service role (SUPABASE_SERVICE_ROLE_KEY).
+
+
+def backfill(supabase):
+    built = 0
+    missing = []
+    for song in all_rows(supabase, "SongData", "song_key, payload_etag", ("created_at", "title", "artist")):
+        if song["payload_etag"] is not None or song["song_key"] is None:
+            continue
+        response = supabase.table("SongData").select("lyrics, hiragana_lyrics, word_mapping, word_refs, kanji_data").eq("song_key", song["song_key"]).execute()
+        if not response.data or response.data[0]["lyrics"] is None:
+            # not processed yet; the worker stores its payload
+            continue
+        row = response.data[0]
+        try:
+            row["word_mapping"] = song_word_mapping(supabase, row)
+        except LookupError as e:
+            missing.append((song["song_key"], e))
+            continue
+        # only fills in rows that still have no payload, so one the worker wrote in the meantime is kept
+        response = supabase.table("SongData").update(build_payload(row, row["kanji_data"])).eq("song_key", song["song_key"]).is_("payload_etag", "null").execute()
+        if response.data:
+            built += 1
+        else:
+            missing.append((song["song_key"], "changed while running"))
+    print(f"SongData: built {built} payloads, skipped {len(missing)} rows")
+    for key, reason in missing:
+        print(f"  {key}: {reason}")
+
+
+if __name__ == "__main__":
+    supabase = create_service_client()
+    if supabase is None:
+        raise SystemExit("SUPABASE_SERVICE_ROLE_KEY is not set")
+    backfill(supabase)
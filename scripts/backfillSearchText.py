@@ -0,0 +1,27 @@
+from db.supabase import create_service_client
+from app.song_search import build_search_text
+from scripts.backfillSongKeys import all_rows
+
+# Fills in SongData.search_text for songs added before migration 0007.
+# Run from the repository root: python -m scripts.backfillSearchText
+# Writes go through the service role (SUPABASE_SERVICE_ROLE_KEY): RLS hides the rows from the anon key, so its updates match nothing.
+
+
+if __name__ == "__main__":
+    supabase = create_service_client()
+    if supabase is None:
+        raise SystemExit("SUPABASE_SERVICE_ROLE_KEY is not set")
+    updated = 0
+    unmatched = []
+    for row in all_rows(supabase, "SongData", "title, artist, search_text", ("created_at", "title", "artist")):
+        if row["search_text"] is not None:
+            continue
+        response = supabase.table("SongData").update({"search_text": build_search_text(row["title"], row["artist"])}).eq("title", row["title"]).eq("artist", row["artist"]).execute()
+        # only rows that came back were written
+        if response.data:
+            updated += len(response.data)
+        else:
+            unmatched.append(row)
+    print(f"SongData: added search text to {updated} rows, {len(unmatched)} rows not updated")
+    for row in unmatched:
+        print(f"  not updated: {row}")
@@ -0,0 +1,60 @@
+from postgrest.exceptions import APIError
+from db.supabase import create_service_client
+from app.song_key import song_key
+
+# Fills in song_key for SongData and Song rows created before migration 0006.
+# Run from the repository root: python -m scripts.backfillSongKeys
+# Rows whose key already belongs to another row (duplicates under the new normalization) are left null and listed at the end.
+# Writes go through the service role (SUPABASE_SERVICE_ROLE_KEY): RLS hides the rows from the anon key, so its updates match nothing.
+
+PAGE_SIZE = 1000
+
+
+def all_rows(supabase, table, columns, order):
+    start = 0
+    while True:
+        query = supabase.table(table).select(columns)
+        for column in order:
+            query = query.order(column)
+        rows = query.range(start, start + PAGE_SIZE - 1).execute().data
+        yield from rows
+        if len(rows) < PAGE_SIZE:
+            break
+        start += PAGE_SIZE
+
+
+def backfill(supabase, table, columns, order, match):
+    updated = 0
+    conflicts = []
+    unmatched = []
+    for row in all_rows(supabase, table, columns, order):
+        if row["song_key"] is not None:
+            continue
+        query = supabase.table(table).update({"song_key": song_key(row["title"], row["artist"])})
+        for column in match:
+            query = query.eq(column, row[column])
+        try:
+            response = query.is_("song_key", "null").execute()
+        except APIError as e:
+            if e.code != "23505":
+                raise
+            conflicts.append(row)
+            continue
+        # only rows that came back were written
+        if response.data:
+            updated += len(response.data)
+        else:
+            unmatched.append(row)
+    print(f"{table}: keyed {updated} rows, {len(conflicts)} duplicates left without a key, {len(unmatched)} rows not updated")
+    for row in conflicts:
+        print(f"  duplicate: {row}")
+    for row in unmatched:
+        print(f"  not updated: {row}")
+
+
+if __name__ == "__main__":
+    supabase = create_service_client()
+    if supabase is None:
+        raise SystemExit("SUPABASE_SERVICE_ROLE_KEY is not set")
+    backfill(supabase, "SongData", "title, artist, song_key", ("created_at", "title", "artist"), ("title", "artist"))
+    backfill(supabase, "Song", "id, title, artist, song_key", ("created_at", "id", "title"), ("id", "title", "artist"))
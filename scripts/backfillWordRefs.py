@@ -0,0 +1,35 @@
+from db.supabase import create_service_client
+from lexicon.word_entries import split_word_mapping
+from scripts.backfillSongKeys import all_rows
+
+# Moves SongData rows processed before migration 0009 from word_mapping to word_refs plus shared WordEntry rows.
+# Run from the repository root: python -m scripts.backfillWordRefs
+# Songs are converted one at a time, entries first, so an interrupted run can simply be started again.
+# Only the service role can add WordEntry rows (db/migrations/0012), so SUPABASE_SERVICE_ROLE_KEY must be set.
+
+
+def backfill(supabase):
+    converted = 0
+    for song in all_rows(supabase, "SongData", "title, artist, word_refs", ("title", "artist")):
+        if song["word_refs"] is not None:
+            continue
+        response = supabase.table("SongData").select("word_mapping").eq("title", song["title"]).eq("artist", song["artist"]).execute()
+        word_mapping = response.data[0]["word_mapping"] if response.data else None
+        if word_mapping is None:
+            continue
+        word_refs, entries = split_word_mapping(word_mapping)
+        if entries:
+            supabase.table("WordEntry").upsert(
+                [{"id": id, "idseq": entry["idseq"] if isinstance(entry["idseq"], int) else None, "entry": entry} for id, entry in entries.items()],
+                on_conflict="id", ignore_duplicates=True,
+            ).execute()
+        supabase.table("SongData").update({"word_refs": word_refs, "word_mapping": None}).eq("title", song["title"]).eq("artist", song["artist"]).execute()
+        converted += 1
+    print(f"SongData: moved {converted} word mappings to WordEntry")
+
+
+if __name__ == "__main__":
+    supabase = create_service_client()
+    if supabase is None:
+        raise SystemExit("SUPABASE_SERVICE_ROLE_KEY is not set")
+    backfill(supabase)
@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+# Cold start report and import budget for the API. Mangum imports app.main on every cold start, so
+# everything imported or created at module level there is paid before the first request is served.
+# Run from the repository root: python scripts/importBudget.py
+# Imports app.main in fresh interpreters, prints where the time went (per top level package, and per
+# module of ours) and exits non-zero when the import is over budget or when a client library that is
+# meant to load on first use (selenium, spotipy, ...) was imported at startup. The docker build runs it, and
+# tests/test_import_budget.py runs the same check under pytest.
+# --init also times creating each lazily initialized client, as the first request that needs it would.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+DEFAULT_BUDGET_MS = int(os.getenv("IMPORT_BUDGET_MS", "2500"))
+# loaded by the getters in app/routers/song.py, app/song_search.py and app/scraping.py, never at import
+LAZY_MODULES = ["selenium", "webdriver_manager", "spotipy", "lyricsgenius", "geniusdotpy", "boto3", "botocore", "jamdict", "fugashi", "pykakasi"]
+# placeholders so app.main can be imported without a .env; nothing connects at import time
+PLACEHOLDER_ENV = {"SUPABASE_URL": "http://localhost:54321", "SUPABASE_API": "placeholder.placeholder.placeholder"}
+OUR_PACKAGES = ("app", "db", "lexicon")
+
+IMPORT_CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+print(json.dumps({"ms": elapsed * 1000, "modules": sorted({name.split(".")[0] for name in sys.modules})}))
+'''
+
+INIT_CHILD = '''
+import json, time
+import app.main
+from app.routers import song
+from app import song_search
+from lexicon.jmdict_index import get_index
+from lexicon.kanji_table import get_kanji_table
+results = {}
+for name, init in [("spotify", song.get_spotify), ("genius", song.get_genius_search), ("sqs", song.get_producer),
+                   ("kakasi", song_search.get_kakasi), ("jmdict_index", get_index), ("kanji_table", get_kanji_table)]:
+    start = time.perf_counter()
+    try:
+        init()
+        results[name] = round((time.perf_counter() - start) * 1000, 1)
+    except Exception as e:
+        results[name] = f"failed: {e}"
+print(json.dumps(results))
+'''
+
+
+def child_env():
+    env = dict(os.environ)
+    for key, value in PLACEHOLDER_ENV.items():
+        env.setdefault(key, value)
+    return env
+
+
+def run_child(code, importtime=False):
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    result = subprocess.run(command, cwd=REPO_ROOT, env=child_env(), capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(f"importing app.main failed:\n{result.stderr[-4000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def parse_importtime(stderr):
+    # lines look like "import time:  self [us] |  cumulative | imported package", nested imports indented
+    packages = defaultdict(int)
+    ours = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        packages[name.split(".")[0]] += int(self_us)
+        if name.split(".")[0] in OUR_PACKAGES:
+            ours[name] = int(cumulative_us)
+    return packages, ours
+
+
+def report(repeat, top):
+    # the fastest of several fresh interpreters, so a noisy build machine doesn't fail the budget by itself
+    runs = [run_child(IMPORT_CHILD)[0] for _ in range(repeat)]
+    result, stderr = run_child(IMPORT_CHILD, importtime=True)
+    packages, ours = parse_importtime(stderr)
+    by_package = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return {
+        "import_ms": round(min(run["ms"] for run in runs), 1),
+        "runs_ms": [round(run["ms"], 1) for run in runs],
+        "packages_ms": {name: round(us / 1000, 1) for name, us in by_package[:top]},
+        "our_modules_cumulative_ms": {name: round(us / 1000, 1) for name, us in sorted(ours.items(), key=lambda item: item[1], reverse=True)},
+        "eager_lazy_modules": [name for name in LAZY_MODULES if name in result["modules"]],
+    }
+
+
+def budget_failures(startup, budget_ms):
+    failures = []
+    if startup["import_ms"] > budget_ms:
+        failures.append(f"importing app.main took {startup['import_ms']} ms, over the {budget_ms} ms budget")
+    if startup["eager_lazy_modules"]:
+        failures.append(f"imported at startup instead of on first use: {', '.join(startup['eager_lazy_modules'])}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report and check the API's cold import time.")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="fail when importing app.main takes longer")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters to time")
+    parser.add_argument("--top", type=int, default=15, help="packages to list")
+    parser.add_argument("--init", action="store_true", help="also time creating each lazy client")
+    args = parser.parse_args()
+
+    startup = report(args.repeat, args.top)
+    if args.init:
+        startup["init_ms"] = run_child(INIT_CHILD)[0]
+
+    failures = budget_failures(startup, args.budget_ms)
+    startup["budget_ms"] = args.budget_ms
+    startup["failures"] = failures
+
+    print(json.dumps(startup, indent=2))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,6 @@
+import os
+from scripts.importBudget import PLACEHOLDER_ENV
+
+# app modules create their Supabase clients at import time; nothing connects until a query runs
+for key, value in PLACEHOLDER_ENV.items():
+    os.environ.setdefault(key, value)
@@ -0,0 +1,14 @@
+from scripts.importBudget import DEFAULT_BUDGET_MS, budget_failures, report
+
+
+def test_cold_import_of_app_main_is_within_budget():
+    startup = report(repeat=3, top=0)
+    assert budget_failures(startup, DEFAULT_BUDGET_MS) == []
+
+
+def test_budget_failures_reports_slow_and_eager_imports():
+    startup = {"import_ms": 3000.0, "eager_lazy_modules": ["selenium"]}
+    failures = budget_failures(startup, 2500)
+    assert len(failures) == 2
+    assert "3000.0 ms" in failures[0]
+    assert "selenium" in failures[1]
@@ -0,0 +1,57 @@
+import os
+import signal
+import time
+
+from pool import ProcessPool, WorkerError
+
+
+def init():
+    pass
+
+
+def square(x):
+    if x < 0:
+        raise ValueError("negative")
+    return x * x
+
+
+def sleep_then_square(x):
+    if x == 1:
+        time.sleep(60)
+    return x * x
+
+
+def test_results_keep_their_order_and_failures_stay_per_task():
+    pool = ProcessPool(2, init)
+    try:
+        results = pool.map(square, [(i,) for i in (3, -1, 2, 5)])
+    finally:
+        pool.close()
+    assert results[0] == 9 and results[2] == 4 and results[3] == 25
+    assert isinstance(results[1], WorkerError)
+
+
+def test_hung_task_times_out_and_the_pool_recovers():
+    pool = ProcessPool(2, init)
+    try:
+        start = time.monotonic()
+        results = pool.map(sleep_then_square, [(i,) for i in range(4)], timeout=1)
+        assert time.monotonic() - start < 5
+        assert [result for i, result in enumerate(results) if i != 1] == [0, 4, 9]
+        assert isinstance(results[1], WorkerError)
+        assert pool.map(square, [(2,), (3,)], timeout=5) == [4, 9]
+    finally:
+        pool.close()
+
+
+def test_killed_processes_fail_their_tasks_instead_of_raising():
+    pool = ProcessPool(2, init)
+    try:
+        pool.map(square, [(1,)])
+        for process, _ in pool.workers:
+            os.kill(process.pid, signal.SIGKILL)
+        time.sleep(0.2)
+        # replaced on the next map
+        assert pool.map(square, [(i,) for i in range(3)]) == [0, 1, 4]
+    finally:
+        pool.close()
@@ -0,0 +1,56 @@
+import asyncio
+
+
+from app.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    async def scenario():
+        flight = SingleFlight()
+        runs = []
+
+        async def work():
+            runs.append(1)
+            await asyncio.sleep(0.01)
+            return "done"
+
+        results = await asyncio.gather(*(flight.do("song", work) for _ in range(5)))
+        return results, runs, flight.calls
+
+    results, runs, calls = asyncio.run(scenario())
+    assert results == ["done"] * 5
+    assert len(runs) == 1
+    assert calls == {}
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        leader = asyncio.create_task(flight.do("song", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("song", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower, leader.cancelled()
+
+    assert asyncio.run(scenario()) == ("done", True)
+
+
+def test_every_caller_gets_the_exception():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise ValueError("no lyrics")
+
+        return await asyncio.gather(flight.do("song", work), flight.do("song", work), return_exceptions=True), flight.calls
+
+    results, calls = asyncio.run(scenario())
+    assert [type(result) for result in results] == [ValueError, ValueError]
+    assert calls == {}
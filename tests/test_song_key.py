@@ -0,0 +1,28 @@
+from app.song_key import song_key, normalize_part, SEPARATOR
+
+
+def test_annotations_and_width_forms_fold_to_one_key():
+    assert song_key("Lemon (Official Audio)", "米津玄師") == song_key("ｌｅｍｏｎ", "米津玄師")
+
+
+def test_featuring_credits_are_dropped():
+    assert normalize_part("Song feat. Someone") == "song"
+    assert normalize_part("Song (ft. Someone)") == "song"
+    assert normalize_part("Song featuring Someone Else") == "song"
+
+
+def test_case_and_whitespace_are_normalized():
+    assert normalize_part("  Hello   WORLD ") == "hello world"
+
+
+def test_names_that_are_only_brackets_keep_their_text():
+    assert normalize_part("[Alexandros]") == "[alexandros]"
+
+
+def test_key_is_artist_then_title():
+    assert song_key("Title", "Artist") == "artist" + SEPARATOR + "title"
+    assert song_key("A", "B") != song_key("B", "A")
+
+
+def test_missing_parts_are_empty():
+    assert song_key(None, None) == SEPARATOR
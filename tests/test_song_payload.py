@@ -0,0 +1,147 @@
+import base64
+import gzip
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import song
+from app.routers.auth import get_current_user
+from lexicon.song_payload import build_payload
+
+SONG = {"lyrics": [["君", "の"]], "hiragana_lyrics": [["きみ", "の"]], "word_mapping": {"君": [{"idseq": 1, "furigana": "きみ"}]}}
+KANJI = {"君": {"meanings": ["you"]}}
+BODY = {**SONG, "kanji_data": KANJI}
+
+
+class FakeQuery:
+    def __init__(self, db):
+        self.db = db
+
+    def select(self, columns):
+        self.columns = [column.strip() for column in columns.split(",")]
+        self.db.selects.append(self.columns)
+        return self
+
+    def eq(self, column, value):
+        return self
+
+    def execute(self):
+        return SimpleNamespace(data=[{column: self.db.row.get(column) for column in self.columns}] if self.db.row else [])
+
+
+class FakeSongData:
+    # one SongData row, and the columns of every select made against it
+    def __init__(self, row):
+        self.row = row
+        self.selects = []
+
+    def table(self, name):
+        return FakeQuery(self)
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(song.router)
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(id="user")
+    return TestClient(app)
+
+
+def use_row(monkeypatch, row):
+    db = FakeSongData(row)
+    monkeypatch.setattr(song, "supabase", db)
+    return db
+
+
+def stored_row(with_br=False):
+    row = {**SONG, "word_refs": None, "kanji_data": KANJI, **build_payload(SONG, KANJI)}
+    if not with_br:
+        row["payload_br"] = None
+    return row
+
+
+def get_song(client, **headers):
+    return client.get("/song/get-song", params={"title": "t", "artist": "a"}, headers=headers)
+
+
+def test_payload_is_the_get_song_body():
+    payload = build_payload(SONG, KANJI)
+    assert json.loads(gzip.decompress(base64.b64decode(payload["payload_gzip"]))) == BODY
+    assert payload["payload_etag"].startswith('W/"')
+
+
+def test_payload_etag_follows_the_content():
+    assert build_payload(SONG, KANJI)["payload_etag"] == build_payload(dict(SONG), dict(KANJI))["payload_etag"]
+    assert build_payload(SONG, KANJI)["payload_etag"] != build_payload(SONG, {})["payload_etag"]
+
+
+def test_accepted_encodings_skips_q_zero():
+    assert song.accepted_encodings("gzip, deflate, br;q=0") == {"gzip", "deflate"}
+
+
+def test_choose_payload_only_picks_stored_columns():
+    accepted = {"br", "gzip"}
+    assert song.choose_payload(accepted, {"payload_br": "x", "payload_gzip": "y"}) == ("br", "payload_br")
+    assert song.choose_payload(accepted, {"payload_br": None, "payload_gzip": "y"}) == ("gzip", "payload_gzip")
+    assert song.choose_payload(set(), {"payload_br": "x", "payload_gzip": "y"}) == (None, "payload_gzip")
+
+
+def test_browser_gets_gzip_when_no_brotli_payload_is_stored(client, monkeypatch):
+    use_row(monkeypatch, stored_row())
+    response = get_song(client, **{"Accept-Encoding": "gzip, deflate, br"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == stored_row()["payload_etag"]
+    assert response.json() == BODY
+
+
+def test_brotli_payload_is_sent_when_stored(client, monkeypatch):
+    pytest.importorskip("brotli")
+    use_row(monkeypatch, stored_row(with_br=True))
+    response = get_song(client, **{"Accept-Encoding": "br"})
+    assert response.headers["content-encoding"] == "br"
+    assert response.json() == BODY
+
+
+def test_identity_client_gets_the_decompressed_body(client, monkeypatch):
+    use_row(monkeypatch, stored_row())
+    response = get_song(client, **{"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert json.loads(response.content) == BODY
+
+
+def test_matching_if_none_match_is_a_304_without_reading_the_body(client, monkeypatch):
+    row = stored_row()
+    db = use_row(monkeypatch, row)
+    response = get_song(client, **{"If-None-Match": row["payload_etag"]})
+    assert response.status_code == 304
+    assert response.headers["etag"] == row["payload_etag"]
+    assert db.selects == [["payload_etag"]]
+
+
+def test_reprocessed_song_is_not_a_304_for_the_old_etag(client, monkeypatch):
+    row = stored_row()
+    old_etag = row["payload_etag"]
+    use_row(monkeypatch, row)
+    assert get_song(client, **{"If-None-Match": old_etag}).status_code == 304
+    row.update(build_payload(SONG, {}))
+    response = get_song(client, **{"If-None-Match": old_etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] == row["payload_etag"] != old_etag
+
+
+def test_song_without_a_payload_is_built_from_the_row(client, monkeypatch):
+    row = {**stored_row(), "payload_gzip": None, "payload_br": None, "payload_etag": None}
+    use_row(monkeypatch, row)
+    response = get_song(client)
+    assert response.status_code == 200
+    assert "etag" not in response.headers
+    assert response.json() == BODY
+
+
+def test_unknown_song(client, monkeypatch):
+    use_row(monkeypatch, None)
+    assert get_song(client).json() == {"message": "Song not found in database."}
@@ -0,0 +1,37 @@
+from word_cache import WordCache
+
+
+def make_cache(tmp_path, version="v1", maxsize=None):
+    path = str(tmp_path / "cache.sqlite")
+    return WordCache(version, path=path, seed_path=path, maxsize=maxsize)
+
+
+def test_values_survive_a_new_process(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("食べる", "word", [{"idseq": 1}])
+    cache.close()
+    assert make_cache(tmp_path).get("食べる") == [{"idseq": 1}]
+
+
+def test_every_hit_is_its_own_copy(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("君", "word", [{"idseq": 1}])
+    cache.get("君").append("changed")
+    assert cache.get("君") == [{"idseq": 1}]
+
+
+def test_entries_from_another_dictionary_version_are_dropped(tmp_path):
+    cache = make_cache(tmp_path, version="v1")
+    cache.put("君", "word", [1])
+    cache.close()
+    assert make_cache(tmp_path, version="v2").get("君") is None
+
+
+def test_closed_connection_reopens_on_next_lookup(tmp_path):
+    cache = make_cache(tmp_path, maxsize=1)
+    cache.put("a", "word", [1])
+    cache.put("b", "word", [2])
+    cache.close()
+    # "a" was evicted from memory, so this reads the reopened disk store
+    assert cache.get("a") == [1]
+    assert cache.stats()["disk_hits"] == 1
@@ -0,0 +1,27 @@
+from lexicon.word_entries import entry_id, referenced_ids, rehydrate, split_word_mapping
+
+YOU = {"idseq": 1, "furigana": "きみ", "definitions": ["you"]}
+EAT = {"idseq": 2, "furigana": "たべる", "definitions": ["to eat"]}
+WORD_MAPPING = {
+    "君": {"root": [YOU], "suffixes": [], "composite": []},
+    "食べた": {"root": [EAT], "suffixes": [{"text": "た", "meaning": "past tense"}], "composite": [dict(YOU)]},
+    # known suffixes are a bare entry list
+    "さ": [EAT],
+    "ね": {"root": None, "suffixes": [], "composite": []},
+}
+
+
+def test_split_and_rehydrate_round_trip():
+    word_refs, entries = split_word_mapping(WORD_MAPPING)
+    assert rehydrate(word_refs, entries) == WORD_MAPPING
+
+
+def test_equal_entries_share_one_id():
+    word_refs, entries = split_word_mapping(WORD_MAPPING)
+    assert len(entries) == 2
+    assert set(referenced_ids(word_refs)) == set(entries)
+
+
+def test_entry_id_ignores_key_order():
+    assert entry_id({"a": 1, "b": 2}) == entry_id({"b": 2, "a": 1})
+    assert entry_id({"a": 1}) != entry_id({"a": 2})